@@ -0,0 +1,107 @@
+import argparse
+import datetime
+import time
+from storage import CHUNK, open_backend, top_limit
+
+# workflowruns only keeps the runs of the last HORIZON (plus any that never completed), older
+# ones are moved to workflowrunsarchive (page compressed on Azure) so the hot table and its
+# indexes stay small for the listener's MERGEs. The derived tables (status matrix, rollups,
+# transitions) are not touched. A run stays in the archive when it is synced again (a full
+# backfill, a redelivered webhook), statusmatrix.write_runs updates it there, so no run is
+# ever in both tables
+HOT, COLD = "workflowruns", "workflowrunsarchive"
+COLUMNS = ("gitid", "author", "runtime", "createtime", "starttime", "endtime", "queuetime",
+           "status", "conclusion", "url", "branchname", "commithash", "workflowname", "repo")
+HORIZON = datetime.timedelta(days=90)
+MIN_HORIZON = datetime.timedelta(days=30)
+
+
+def archived_until(conn, repo=None):
+    """Create time of the newest archived run (of `repo`), None while nothing is archived"""
+    top, limit = top_limit(conn, 1)
+    where, params = "createtime IS NOT NULL", []
+    if repo:
+        where += " AND repo = ?"
+        params.append(repo)
+    c = conn.cursor()
+    c.execute(f"SELECT {top} createtime FROM {COLD} WHERE {where} ORDER BY createtime DESC {limit}", params)
+    row = c.fetchone()
+    return row[0] if row else None
+
+
+def archived(conn, gitids):
+    """The archived runs among `gitids`"""
+    gitids = list(gitids)
+    found = set()
+    c = conn.cursor()
+    for i in range(0, len(gitids), CHUNK):
+        chunk = gitids[i:i + CHUNK]
+        c.execute(f"SELECT gitid FROM {COLD} WHERE gitid IN ({', '.join('?' for _ in chunk)})", chunk)
+        found.update(gitid for (gitid, ) in c.fetchall())
+    return found
+
+
+def runs(conn, since=None, repo=None, alias=HOT):
+    """
+    FROM clause for the runs created from `since` on: the hot table alone when the range
+    starts after everything archived, else hot and archived runs as one derived table named
+    `alias`. Filters on the derived table are pushed into both sides by the planner
+    """
+    if since is not None:
+        boundary = archived_until(conn, repo)
+        if boundary is None or since > boundary:
+            return f"{HOT} AS {alias}"
+    columns = ", ".join(COLUMNS)
+    return f"(SELECT {columns} FROM {HOT} UNION ALL SELECT {columns} FROM {COLD}) AS {alias}"
+
+
+def archive(conn, repo, horizon=HORIZON, batch=10_000):
+    """Move the completed runs of `repo` created before now - `horizon` to the archive, returns the runs moved"""
+    if horizon < MIN_HORIZON:
+        raise ValueError(f"runs younger than {MIN_HORIZON.days} days can still be re-run, use a longer horizon")
+    cutoff = datetime.datetime.utcnow() - horizon
+    top, limit = top_limit(conn)
+    columns = ", ".join(COLUMNS)
+    c = conn.cursor()
+    moved = 0
+    start = time.monotonic()
+    while True:
+        where = "repo = ? AND createtime < ? AND status = 'completed'"
+        c.execute(
+            f"SELECT {top} gitid FROM {HOT} WHERE {where} ORDER BY createtime {limit}",
+            [batch, repo, cutoff] if top else [repo, cutoff, batch],
+        )
+        gitids = [row[0] for row in c.fetchall()]
+        if not gitids:
+            break
+        try:
+            for i in range(0, len(gitids), CHUNK):
+                chunk = gitids[i:i + CHUNK]
+                keys = ", ".join("?" for _ in chunk)
+                c.execute(f"DELETE FROM {COLD} WHERE gitid IN ({keys})", chunk)
+                c.execute(f"INSERT INTO {COLD} ({columns}) SELECT {columns} FROM {HOT} WHERE gitid IN ({keys})", chunk)
+                c.execute(f"DELETE FROM {HOT} WHERE gitid IN ({keys})", chunk)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        moved += len(gitids)
+        print(f"{COLD}: {moved} runs moved in {time.monotonic() - start:.1f}s")
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Archive",
+                                     description="Move old workflow runs out of the live table")
+    parser.add_argument('-r', '--repo', required=True, help="repository to archive the runs of")
+    parser.add_argument('-pwd', '--password', help="Password to remote database")
+    parser.add_argument('-db', '--database', help="Local SQLite database file to use instead of the remote database")
+    parser.add_argument('--horizon', type=int, default=HORIZON.days, help="Days of runs to keep in the live table")
+    args = parser.parse_args()
+
+    backend = open_backend(args.database, args.password)
+    backend.create_schema()
+    with backend.connection() as conn:
+        print("ARCHIVING WORKFLOW RUNS")
+        archive(conn, args.repo, datetime.timedelta(days=args.horizon))
+    backend.close()
@@ -0,0 +1,60 @@
+import argparse
+import datetime
+import time
+import numpy as np
+from runarrays import RunArrays, CONCLUSIONS, STATUSES, metrics
+
+
+def synthetic(n, workflows=20, days=90, seed=0):
+    """`n` random runs spread over the last `days` days"""
+    rng = np.random.default_rng(seed)
+    now = int(time.time())
+    return RunArrays(
+        rng.integers(now - days * 24 * 60 * 60, now, n),
+        rng.lognormal(4, 1.5, n),
+        rng.lognormal(7, 1, n),
+        rng.choice(len(CONCLUSIONS) + 1, n, p=[0.85, 0.1, 0.03, 0.02]),
+        rng.choice(len(STATUSES), n, p=[0.97, 0.02, 0.01]),
+        rng.integers(0, workflows, n),
+        [f"workflow {i}" for i in range(workflows)],
+    )
+
+
+def python_metrics(records, now):
+    """The list comprehension version the dashboard used to run, for comparison"""
+    recent = [r for r in records if now - r["createtime"] < 24 * 60 * 60]
+    failed = len([r for r in recent if r["conclusion"] == "failure"])
+    queued = len([r for r in recent if r["status"] == "queued"])
+    queue_times = sorted(r["queuetime"] for r in recent)
+    days = {}
+    for r in records:
+        day = days.setdefault(r["createtime"] // 86400, {"success": 0, "failure": 0})
+        if r["conclusion"] in day:
+            day[r["conclusion"]] += 1
+    return failed, queued, queue_times[int(len(queue_times) * 0.95)] if queue_times else 0, days
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Benchmark",
+                                     description="Time the vectorized run metrics against plain Python")
+    parser.add_argument('-n', '--sizes', type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 5_000_000], help="Run counts to time")
+    parser.add_argument('--python_limit', type=int, default=1_000_000, help="Largest run count to also time the plain Python version on")
+    args = parser.parse_args()
+
+    print(f"{'runs':>10} {'numpy':>10} {'python':>10}")
+    for n in args.sizes:
+        runs = synthetic(n)
+        start = time.perf_counter()
+        metrics(runs, now=datetime.datetime.utcnow())
+        runs.per_workflow()
+        vectorized = time.perf_counter() - start
+        plain = "-"
+        if n <= args.python_limit:
+            records = [
+                {"createtime": int(t), "queuetime": float(q), "conclusion": (CONCLUSIONS + (None, ))[c], "status": STATUSES[s]}
+                for t, q, c, s in zip(runs.createtime, runs.queuetime, runs.conclusion, runs.status)
+            ]
+            start = time.perf_counter()
+            python_metrics(records, int(time.time()))
+            plain = f"{time.perf_counter() - start:9.3f}s"
+        print(f"{n:>10} {vectorized:9.3f}s {plain:>10}")
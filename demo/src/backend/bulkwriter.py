@@ -0,0 +1,196 @@
+import time
+from itertools import islice
+from tqdm import tqdm
+from storage import dialect
+
+# table name -> (key columns, all columns) for every table the backfill writes
+TABLES = {
+    "repos": (("name",), ("name",)),
+    "branches": (("name",), ("name", "repo")),
+    "commits": (("hash",), ("hash", "author", "message", "time", "repo")),
+    "workflows": (("name",), ("name", "url", "repo")),
+    "workflowruns": (
+        ("gitid",),
+        ("gitid", "author", "runtime", "createtime", "starttime", "endtime", "queuetime",
+         "status", "conclusion", "url", "branchname", "commithash", "workflowname", "repo"),
+    ),
+    "workflowrunsarchive": (
+        ("gitid",),
+        ("gitid", "author", "runtime", "createtime", "starttime", "endtime", "queuetime",
+         "status", "conclusion", "url", "branchname", "commithash", "workflowname", "repo"),
+    ),
+    "runtimings": (("gitid",), ("gitid", "durationms")),
+    "commit_workflow_status": (
+        ("repo", "commithash", "workflowname"),
+        ("repo", "commithash", "workflowname", "gitid", "status", "conclusion", "branchname", "createtime", "endtime"),
+    ),
+    "serverbuilds": (
+        ("id",),
+        ("id", "repo", "branchname", "commithash", "status", "starttime", "endtime", "summary", "steps", "seq", "loglines"),
+    ),
+    "runrollups": (
+        ("granularity", "bucketstart", "repo", "workflowname", "branchname", "author"),
+        ("granularity", "bucketstart", "repo", "workflowname", "branchname", "author", "runs", "successes",
+         "failures", "cancellations", "queuetimesum", "runtimesum", "queuetimemax", "runtimemax"),
+    ),
+    "runsketches": (
+        ("granularity", "bucketstart", "repo", "workflowname", "metric"),
+        ("granularity", "bucketstart", "repo", "workflowname", "metric", "sketch"),
+    ),
+    # keyed by the branchstates_commit unique index, so a commit that moves in branch order is updated in place
+    "branchstates": (
+        ("repo", "branchname", "workflowname", "commithash"),
+        ("repo", "branchname", "workflowname", "committime", "commithash", "green", "decidedat"),
+    ),
+    "transitions": (
+        ("repo", "branchname", "workflowname", "committime", "commithash"),
+        ("repo", "branchname", "workflowname", "committime", "commithash", "green"),
+    ),
+}
+
+# how an existing row is combined with an incoming one, for columns that are not simply
+# overwritten. {target} is the stored row and {source} the incoming one
+UPDATES = {
+    # rollup rows of a batch are added to the stored counters
+    "runrollups": {
+        **{c: f"{{target}}.{c} + {{source}}.{c}"
+           for c in ("runs", "successes", "failures", "cancellations", "queuetimesum", "runtimesum")},
+        **{m: f"CASE WHEN {{source}}.{m} > {{target}}.{m} THEN {{source}}.{m} ELSE {{target}}.{m} END"
+           for m in ("queuetimemax", "runtimemax")},
+    },
+}
+
+# condition an existing row has to meet to be updated, so a stale row never overwrites a
+# newer one. {target} is the stored row and {source} the incoming one
+GUARDS = {
+    "workflowruns": "{target}.endtime IS NULL OR {source}.endtime >= {target}.endtime",
+    "workflowrunsarchive": "{target}.endtime IS NULL OR {source}.endtime >= {target}.endtime",
+    # a newer run of the workflow on the commit, or a newer state of the same run
+    "commit_workflow_status": (
+        "{source}.createtime > {target}.createtime"
+        " OR ({source}.gitid = {target}.gitid AND {source}.endtime >= {target}.endtime)"
+    ),
+    # a verdict from a newer run of the workflow on the commit
+    "branchstates": "{source}.decidedat >= {target}.decidedat",
+    # a build id that is reused by a later build
+    "serverbuilds": "{source}.starttime >= {target}.starttime",
+}
+
+
+def update(table, column, target, source):
+    """Expression of the new value of `column` when an incoming row matches a stored one"""
+    return UPDATES.get(table, {}).get(column, f"{{source}}.{column}").format(target=target, source=source)
+
+
+def merge_sql(table, stage):
+    """Build the set-based MERGE that upserts every row of `stage` into `table`"""
+    keys, columns = TABLES[table]
+    on = " AND ".join(f"target.{k} = source.{k}" for k in keys)
+    updates = [c for c in columns if c not in keys] or list(keys)
+    matched = "WHEN MATCHED"
+    if table in GUARDS:
+        matched += f" AND ({GUARDS[table].format(target='target', source='source')})"
+    return f"""
+    MERGE INTO {table} AS target
+    USING {stage} AS source
+    ON {on}
+    {matched} THEN
+        UPDATE SET {", ".join(f"target.{c} = {update(table, c, 'target', 'source')}" for c in updates)}
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT ({", ".join(columns)})
+        VALUES ({", ".join(f"source.{c}" for c in columns)});
+    """
+
+
+def upsert_sql(table):
+    """Build the SQLite INSERT ... ON CONFLICT that upserts one row into `table`"""
+    keys, columns = TABLES[table]
+    updates = [c for c in columns if c not in keys]
+    sql = f"""
+    INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})
+    ON CONFLICT ({", ".join(keys)}) DO """
+    if not updates:
+        return sql + "NOTHING"
+    sql += "UPDATE SET " + ", ".join(f"{c} = {update(table, c, table, 'excluded')}" for c in updates)
+    if table in GUARDS:
+        sql += f" WHERE {GUARDS[table].format(target=table, source='excluded')}"
+    return sql
+
+
+def dedupe(table, rows):
+    """MERGE rejects two source rows matching one target row, keep the last one per key"""
+    keys, columns = TABLES[table]
+    index = [columns.index(k) for k in keys]
+    unique = {}
+    for row in rows:
+        unique[tuple(row[i] for i in index)] = row
+    return list(unique.values())
+
+
+class BulkWriter:
+    """
+    Upserts rows in batches. On Azure SQL each batch is bulk inserted into a session temp
+    table with fast_executemany and merged into the real table with one MERGE statement,
+    on SQLite the batch is upserted with executemany in a single transaction
+    """
+
+    def __init__(self, conn, batch_size=1000):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.dialect = dialect(conn)
+        self.staged = set()
+
+    def stage(self, table):
+        stage = f"#stage_{table}"
+        c = self.conn.cursor()
+        if table not in self.staged:
+            # copy the column types of the target table without copying any rows, a pooled
+            # connection may still hold the staging table of an earlier writer
+            _, columns = TABLES[table]
+            c.execute(f"DROP TABLE IF EXISTS {stage}")
+            c.execute(f"SELECT TOP 0 {', '.join(columns)} INTO {stage} FROM {table}")
+            self.staged.add(table)
+        else:
+            c.execute(f"TRUNCATE TABLE {stage}")
+        return stage
+
+    def write_batch(self, table, rows, commit=True):
+        rows = dedupe(table, rows)
+        if not rows:
+            # fast_executemany rejects an empty parameter list, SQLite would accept it
+            return 0
+        if self.dialect == "sqlite":
+            self.conn.executemany(upsert_sql(table), rows)
+        else:
+            _, columns = TABLES[table]
+            stage = self.stage(table)
+            c = self.conn.cursor()
+            c.fast_executemany = True
+            c.executemany(
+                f"INSERT INTO {stage} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                rows,
+            )
+            c.execute(merge_sql(table, stage))
+        if commit:
+            self.conn.commit()
+        return len(rows)
+
+    def write(self, table, rows, total=None):
+        """Upsert an iterable of row tuples into `table`, committing once per batch"""
+        rows = iter(rows)
+        written = 0
+        start = time.monotonic()
+        with tqdm(total=total, desc=f"Adding {table} to DB", unit="rows") as progress:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                written += self.write_batch(table, batch)
+                progress.update(len(batch))
+        report(table, written, time.monotonic() - start)
+        return written
+
+
+def report(table, rows, elapsed):
+    rate = rows / elapsed if elapsed > 0 else 0
+    print(f"{table}: {rows} rows in {elapsed:.1f}s ({rate:.0f} rows/s)")
@@ -0,0 +1,223 @@
+import time
+from storage import CHUNK, top_limit
+import archive
+
+# branchstates keeps the verdict (green = success, red = failure) of the latest run of every
+# workflow on every commit of a branch, in commit order. transitions keeps only the commits
+# whose verdict differs from the previous commit's, so "since when is it red", the last
+# good commit and the blame range are a couple of index seeks however long the history is.
+# Both are updated as runs are written, cancelled and unfinished runs (e.g. a rerun in
+# progress) leave the previous verdict in place
+VERDICTS = {"success": 1, "failure": 0}
+KEY = "repo = ? AND branchname = ? AND workflowname = ?"
+
+# the latest decided (succeeded or failed) run of every workflow on every commit
+REBUILD_STATES = """
+INSERT INTO branchstates (repo, branchname, workflowname, committime, commithash, green, decidedat)
+SELECT repo, branchname, workflowname, committime, commithash, green, createtime FROM (
+    SELECT r.repo, r.branchname, r.workflowname, COALESCE(c.time, r.createtime) AS committime, r.commithash,
+        CASE WHEN r.conclusion = 'success' THEN 1 ELSE 0 END AS green, r.createtime,
+        ROW_NUMBER() OVER (PARTITION BY r.branchname, r.workflowname, r.commithash ORDER BY r.createtime DESC, r.endtime DESC) AS newest
+    FROM {runs} LEFT JOIN commits AS c ON c.hash = r.commithash
+    WHERE r.repo = ? AND r.branchname IS NOT NULL AND r.commithash IS NOT NULL AND r.workflowname IS NOT NULL
+    AND r.createtime IS NOT NULL AND r.conclusion IN ('success', 'failure')
+) AS decided
+WHERE newest = 1
+"""
+
+REBUILD_TRANSITIONS = """
+INSERT INTO transitions (repo, branchname, workflowname, committime, commithash, green)
+SELECT repo, branchname, workflowname, committime, commithash, green FROM (
+    SELECT repo, branchname, workflowname, committime, commithash, green,
+        LAG(green) OVER (PARTITION BY branchname, workflowname ORDER BY committime, commithash) AS previous
+    FROM branchstates WHERE repo = ?
+) AS ordered
+WHERE previous IS NULL OR previous <> green
+"""
+
+
+def neighbour(c, conn, key, committime, commithash, after=False):
+    """The (committime, commithash, green) of the commit before (or after) a point in branch order"""
+    top, limit = top_limit(conn, 1)
+    op, order = (">", "ASC") if after else ("<", "DESC")
+    c.execute(
+        f"""
+        SELECT {top} committime, commithash, green FROM branchstates
+        WHERE {KEY} AND (committime {op} ? OR (committime = ? AND commithash {op} ?))
+        ORDER BY committime {order}, commithash {order} {limit}
+        """,
+        key + (committime, committime, commithash),
+    )
+    return c.fetchone()
+
+
+def stored_states(conn, decided):
+    """
+    {(repo, branchname, workflowname, commithash): (committime, green, decidedat)} of the stored
+    verdicts among `decided`, read with one lookup per branch and workflow (and chunk of commits)
+    """
+    commits = {}
+    for repo, branchname, workflowname, commithash in decided:
+        commits.setdefault((repo, branchname, workflowname), []).append(commithash)
+    stored = {}
+    c = conn.cursor()
+    for key, hashes in commits.items():
+        for i in range(0, len(hashes), CHUNK):
+            chunk = hashes[i:i + CHUNK]
+            c.execute(
+                f"SELECT commithash, committime, green, decidedat FROM branchstates WHERE {KEY} AND commithash IN ({', '.join('?' for _ in chunk)})",
+                key + tuple(chunk),
+            )
+            for commithash, committime, green, decidedat in c.fetchall():
+                stored[key + (commithash, )] = (committime, green, decidedat)
+    return stored
+
+
+def commit_times(conn, hashes):
+    """{hash: time} of the commits among `hashes` the database has a time for"""
+    hashes = list(hashes)
+    times = {}
+    c = conn.cursor()
+    for i in range(0, len(hashes), CHUNK):
+        chunk = hashes[i:i + CHUNK]
+        c.execute(f"SELECT hash, time FROM commits WHERE hash IN ({', '.join('?' for _ in chunk)})", chunk)
+        times.update((commithash, time_) for commithash, time_ in c.fetchall() if time_)
+    return times
+
+
+def retransition(writer, key, start):
+    """
+    Recompute the transitions of one branch and workflow from the (committime, commithash)
+    `start` on, after the branch states there changed. Batches touch recent commits, so this
+    only reads the end of the branch
+    """
+    conn = writer.conn
+    c = conn.cursor()
+    committime, commithash = start
+    previous = neighbour(c, conn, key, committime, commithash)
+    since = f"{KEY} AND (committime > ? OR (committime = ? AND commithash >= ?))"
+    params = key + (committime, committime, commithash)
+    c.execute(f"SELECT committime, commithash, green FROM branchstates WHERE {since} ORDER BY committime, commithash", params)
+    rows = []
+    green = previous[2] if previous else None
+    for point in c.fetchall():
+        if point[2] != green:
+            rows.append(key + tuple(point))
+        green = point[2]
+    c.execute(f"DELETE FROM transitions WHERE {since}", params)
+    if rows:
+        writer.write_batch("transitions", rows, commit=False)
+
+
+def record(writer, run_rows):
+    """
+    Apply the newest succeeded or failed run of each (commit, workflow) among workflowruns
+    rows being written. A run created before the one behind the stored verdict is stale and
+    changes nothing. The stored verdicts and commit times are read for the whole batch, the
+    new ones are upserted in bulk and the transitions of every branch and workflow whose
+    verdicts changed are recomputed once; the caller commits
+    """
+    decided = {}
+    for run in run_rows:
+        _, _, _, createtime, _, endtime, _, _, conclusion, _, branchname, commithash, workflowname, repo = run
+        if conclusion not in VERDICTS or not (branchname and commithash and workflowname) or createtime is None:
+            continue
+        key = (repo, branchname, workflowname, commithash)
+        newest = decided.get(key)
+        if newest is None or (createtime, endtime or createtime) >= (newest[3], newest[5] or newest[3]):
+            decided[key] = run
+    if not decided:
+        return
+    stored = stored_states(writer.conn, decided)
+    times = commit_times(writer.conn, {commithash for _, _, _, commithash in decided})
+    rows = []
+    changed = {}  # (repo, branchname, workflowname) -> earliest (committime, commithash) that changed
+    for (repo, branchname, workflowname, commithash), run in decided.items():
+        createtime, conclusion = run[3], run[8]
+        key = (repo, branchname, workflowname)
+        old = stored.get(key + (commithash, ))
+        if old is not None and old[2] > createtime:
+            continue
+        # commits the database has not seen are ordered by their run instead
+        committime, green = times.get(commithash, createtime), VERDICTS[conclusion]
+        rows.append(key + (committime, commithash, green, createtime))
+        if old is not None and (old[0], old[1]) == (committime, green):
+            continue
+        for start in [(committime, commithash)] + ([(old[0], commithash)] if old else []):
+            changed[key] = min(changed.get(key, start), start)
+    if rows:
+        writer.write_batch("branchstates", rows, commit=False)
+    for key, start in changed.items():
+        retransition(writer, key, start)
+
+
+def rebuild(conn, repo):
+    """Recompute the states and transitions of `repo` from the stored runs, archived ones included"""
+    start = time.monotonic()
+    c = conn.cursor()
+    c.execute("DELETE FROM transitions WHERE repo = ?", (repo, ))
+    c.execute("DELETE FROM branchstates WHERE repo = ?", (repo, ))
+    c.execute(REBUILD_STATES.format(runs=archive.runs(conn, alias="r")), (repo, ))
+    c.execute(REBUILD_TRANSITIONS, (repo, ))
+    conn.commit()
+    print(f"transitions: rebuilt in {time.monotonic() - start:.1f}s")
+
+
+def broken_interval(conn, repo, branch, workflow, at=None):
+    """
+    If `workflow` is red on `branch` (at commit time `at`, now by default), the first bad
+    commit and the last good one before it as {"first_bad": (hash, time), "last_good":
+    (hash, time) or None}. None while it is green
+    """
+    top, limit = top_limit(conn, 1)
+    key = (repo, branch, workflow)
+    c = conn.cursor()
+    where, params = KEY, key
+    if at is not None:
+        where += " AND committime <= ?"
+        params += (at, )
+    c.execute(
+        f"SELECT {top} committime, commithash, green FROM transitions WHERE {where} ORDER BY committime DESC, commithash DESC {limit}",
+        params,
+    )
+    last = c.fetchone()
+    if last is None or last[2]:
+        return None
+    committime, commithash, _ = last
+    good = neighbour(c, conn, key, committime, commithash)
+    return {
+        "first_bad": (commithash, committime),
+        "last_good": (good[1], good[0]) if good else None,
+    }
+
+
+def blame(conn, repo, branch, workflow, at=None, limit=100):
+    """The broken interval of `workflow` with the commits that landed in it, newest first"""
+    interval = broken_interval(conn, repo, branch, workflow, at)
+    if interval is None:
+        return None
+    first_bad_time = interval["first_bad"][1]
+    where, params = "repo = ? AND time <= ?", [repo, first_bad_time]
+    if interval["last_good"]:
+        where += " AND time > ?"
+        params.append(interval["last_good"][1])
+    top, bottom = top_limit(conn)
+    c = conn.cursor()
+    c.execute(
+        f"SELECT {top} hash, author, message, time FROM commits WHERE {where} ORDER BY time DESC {bottom}",
+        [limit] + params if top else params + [limit],
+    )
+    interval["suspects"] = c.fetchall()
+    return interval
+
+
+def broken(conn, repo, branch):
+    """{workflow: broken interval} of every workflow currently red on `branch`"""
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT workflowname FROM transitions WHERE repo = ? AND branchname = ?", (repo, branch))
+    intervals = {}
+    for (workflow, ) in c.fetchall():
+        interval = broken_interval(conn, repo, branch, workflow)
+        if interval:
+            intervals[workflow] = interval
+    return intervals
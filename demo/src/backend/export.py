@@ -0,0 +1,188 @@
+import argparse
+import datetime
+import json
+import os
+import time
+from urllib.parse import quote
+from storage import open_backend, top_limit
+import archive
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# run and commit history as Parquet files partitioned like <table>/repo=<repo>/month=<YYYY-MM>/,
+# so pandas/pyarrow readers only open the partitions a filter selects and read only the
+# projected columns. The repo is a partition key and is not repeated inside the files.
+# Months are exported once they are over, only the running month is rewritten on every export
+TABLES = {
+    "workflowruns": ("createtime", (
+        ("gitid", "int64"), ("author", "string"), ("runtime", "float64"), ("createtime", "timestamp"),
+        ("starttime", "timestamp"), ("endtime", "timestamp"), ("queuetime", "float64"), ("status", "string"),
+        ("conclusion", "string"), ("url", "string"), ("branchname", "string"), ("commithash", "string"),
+        ("workflowname", "string"),
+    )),
+    "commits": ("time", (
+        ("hash", "string"), ("author", "string"), ("message", "string"), ("time", "timestamp"),
+    )),
+}
+
+# runs of a month can still finish (or be rerun) shortly after it ends
+GRACE = datetime.timedelta(days=2)
+MANIFEST = "_manifest.json"
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet export needs pyarrow, install it with `pip install pyarrow`")
+
+
+def arrow_schema(columns):
+    types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(), "timestamp": pa.timestamp("us")}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def month_start(t):
+    return datetime.datetime(t.year, t.month, 1)
+
+
+def next_month(t):
+    return datetime.datetime(t.year + t.month // 12, t.month % 12 + 1, 1)
+
+
+def source(conn, table):
+    """FROM clause of `table`, archived runs included"""
+    return archive.runs(conn, alias=table) if table == archive.HOT else table
+
+
+def partition(output, table, repo, month):
+    return os.path.join(output, table, f"repo={quote(repo, safe='')}", f"month={month:%Y-%m}")
+
+
+def bounds(conn, table, repo):
+    """Oldest and newest time of `repo`'s rows in `table`, None for an empty table"""
+    column = TABLES[table][0]
+    top, limit = top_limit(conn, 1)
+    c = conn.cursor()
+    ends = []
+    for order in ("ASC", "DESC"):
+        c.execute(
+            f"SELECT {top} {column} FROM {source(conn, table)} WHERE repo = ? AND {column} IS NOT NULL ORDER BY {column} {order} {limit}",
+            (repo, ),
+        )
+        row = c.fetchone()
+        if row is None:
+            return None
+        ends.append(row[0])
+    return ends
+
+
+def load_manifest(output):
+    try:
+        with open(os.path.join(output, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(output, manifest):
+    tmp = os.path.join(output, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(output, MANIFEST))
+
+
+def export_month(conn, output, table, repo, month):
+    """Write one partition, returns its row count"""
+    column, columns = TABLES[table]
+    c = conn.cursor()
+    c.execute(
+        f"SELECT {', '.join(name for name, _ in columns)} FROM {source(conn, table)} WHERE repo = ? AND {column} >= ? AND {column} < ? ORDER BY {column}",
+        (repo, month, next_month(month)),
+    )
+    rows = c.fetchall()
+    data = {name: [row[i] for row in rows] for i, (name, _) in enumerate(columns)}
+    directory = partition(output, table, repo, month)
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, "part-0.parquet.tmp")
+    pq.write_table(pa.Table.from_pydict(data, schema=arrow_schema(columns)), tmp, compression="zstd")
+    os.replace(tmp, os.path.join(directory, "part-0.parquet"))
+    return len(rows)
+
+
+def export(conn, output, repos, tables=tuple(TABLES)):
+    """
+    Export every month of `repos` that was not exported after it (plus GRACE) ended.
+    Returns the number of partitions written
+    """
+    require_pyarrow()
+    os.makedirs(output, exist_ok=True)
+    manifest = load_manifest(output)
+    now = datetime.datetime.utcnow()
+    written = 0
+    for table in tables:
+        for repo in repos:
+            ends = bounds(conn, table, repo)
+            if ends is None:
+                continue
+            month = month_start(ends[0])
+            while month <= ends[1]:
+                key = f"{table}/{repo}/{month:%Y-%m}"
+                exported = manifest.get(key)
+                if exported is None or datetime.datetime.fromisoformat(exported) < next_month(month) + GRACE:
+                    start = time.monotonic()
+                    rows = export_month(conn, output, table, repo, month)
+                    manifest[key] = now.isoformat()
+                    save_manifest(output, manifest)
+                    written += 1
+                    print(f"{key}: {rows} rows in {time.monotonic() - start:.1f}s")
+                month = next_month(month)
+    return written
+
+
+def read(output, table="workflowruns", columns=None, repo=None, start=None, end=None):
+    """
+    Read exported history into a DataFrame. Only the partitions of `repo` and of the months
+    overlapping [start, end) are opened and only `columns` are decoded; the time filter is
+    also pushed down to the row groups
+    """
+    import pandas as pd
+    require_pyarrow()
+    column = TABLES[table][0]
+    filters = []
+    if repo:
+        filters.append(("repo", "=", repo))
+    if start:
+        filters += [("month", ">=", f"{start:%Y-%m}"), (column, ">=", pd.Timestamp(start))]
+    if end:
+        filters += [("month", "<=", f"{end:%Y-%m}"), (column, "<", pd.Timestamp(end))]
+    return pd.read_parquet(
+        os.path.join(output, table),
+        engine="pyarrow",
+        columns=columns,
+        filters=filters or None,
+        partitioning="hive",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Export",
+                                     description="Export run and commit history to Parquet for analytics")
+    parser.add_argument('-r', '--repo', nargs="+", help="repositories to export, all by default")
+    parser.add_argument('-o', '--output', default="history", help="directory to write the partitions to")
+    parser.add_argument('-pwd', '--password', help="Password to remote database")
+    parser.add_argument('-db', '--database', help="Local SQLite database file to use instead of the remote database")
+    args = parser.parse_args()
+
+    backend = open_backend(args.database, args.password)
+    with backend.connection() as conn:
+        repos = args.repo
+        if not repos:
+            c = conn.cursor()
+            c.execute("SELECT name FROM repos")
+            repos = [row[0] for row in c.fetchall()]
+        print("EXPORTING HISTORY")
+        export(conn, args.output, repos)
+    backend.close()
@@ -0,0 +1,70 @@
+import asyncio
+import queue
+import threading
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from client import GitHubClient
+
+# list endpoints the backfill pages through and the key holding their items
+ENDPOINTS = {
+    "actions/runs": "workflow_runs",
+    "commits": None,
+    "branches": None,
+}
+
+_DONE = object()
+
+
+def fetch_pages(token, repo, endpoint, start=1, concurrency=8, params=None, queue_size=None):
+    """
+    Yield (page number, items) for a repository list endpoint in page order. A producer
+    thread runs the async GitHubClient, requesting up to `concurrency` pages at once, and
+    hands pages over through a bounded queue so fetching overlaps with the database writes
+    while at most `queue_size` pages are held in memory
+    """
+    owner, name = repo.split("/")
+    key = ENDPOINTS[endpoint]
+    pages = queue.Queue(maxsize=queue_size or 2 * concurrency)
+    stop = threading.Event()
+
+    async def offer(item):
+        # poll instead of blocking so requests in flight keep progressing while the queue is full
+        while not stop.is_set():
+            try:
+                pages.put_nowait(item)
+                return True
+            except queue.Full:
+                await asyncio.sleep(0.05)
+        return False
+
+    async def produce():
+        listing = GitHubClient(token).iter_pages(owner, name, endpoint, params, start=start, concurrency=concurrency)
+        try:
+            async for page, data in listing:
+                if not await offer((page, data[key] if key else data)):
+                    break
+        finally:
+            await listing.aclose()
+
+    def run():
+        try:
+            asyncio.run(produce())
+            error = None
+        except Exception as e:
+            error = e
+        asyncio.run(offer((_DONE, error)))
+
+    producer = threading.Thread(target=run, name=f"fetch {endpoint}", daemon=True)
+    producer.start()
+    try:
+        while True:
+            page, items = pages.get()
+            if page is _DONE:
+                if items is not None:
+                    raise items
+                return
+            yield page, items
+    finally:
+        stop.set()
+        producer.join()
@@ -1,5 +1,4 @@
 from github import Github
-import datetime, time
 import numpy as np
 import pandas as pd
 from flask import Flask, request, jsonify
@@ -7,172 +6,133 @@ import tqdm
 import pickle
 import os
 import argparse
-from sqlauthenticator import connector
+import json
+import pyodbc
+import sqlite3
+from storage import open_backend
+from spool import Spool, SpoolConsumer
+from bulkwriter import BulkWriter
+from syncstate import parse_time
+from statusmatrix import write_runs
 
 class Dashboard:
 
-    def __init__(self, key, repo, password, port=5000):
+    def __init__(self, key, repo, password, port=5000, spool_dir="spool", database=None):
         self.key = key
         self.repo_path = repo
         self.github = Github(self.key)
         self.repo = self.github.get_repo(self.repo_path)
         self.password = password
+        self.backend = open_backend(database, password, minsize=1, maxsize=4)
+        self.backend.create_schema()
         self.app = Flask(__name__)
         self.app.add_url_rule(
             "/webhook", "webhook", self.handle_webhook, methods=["POST"]
         )
         self.port = port
+        # deliveries are acknowledged once spooled to disk and applied to the database
+        # in the background, so a slow database never times out a GitHub delivery
+        self.spool = Spool(spool_dir)
+        # wait briefly after the first event so the deliveries of a run arrive in one batch
+        self.consumer = SpoolConsumer(self.spool, self.apply, linger=0.5, retry_on=(pyodbc.Error, sqlite3.Error, OSError))
 
     def start(self):
-        self.app.run(host='0.0.0.0', port=self.port, debug=True)
+        self.consumer.start()
+        # the reloader would start a second process consuming the same spool
+        self.app.run(host='0.0.0.0', port=self.port, debug=True, use_reloader=False)
 
     def stop(self):
-        pass
+        self.consumer.stop()
+        self.spool.close()
+        self.backend.close()
 
     def handle_webhook(self):
-        data = request.get_json()
+        self.spool.append(request.get_data())
+        return "", 200
+
+    def apply(self, payloads):
+        """
+        Apply a batch of spooled payloads. Events are collapsed per table, a workflow run
+        only keeps its newest state, and each table is written with one batched MERGE
+        """
+        rows = {"branches": [], "commits": [], "workflowruns": {}}
+        for payload in payloads:
+            try:
+                self.collect(json.loads(payload), rows)
+            except Exception as e:
+                print(f"Skipping spooled payload that failed to parse: {e}")
+        with self.backend.connection() as conn:
+            writer = BulkWriter(conn, len(payloads))
+            if rows["branches"]:
+                print(f"ADDING {len(rows['branches'])} BRANCHES")
+                writer.write_batch("branches", rows["branches"])
+            if rows["commits"]:
+                print(f"ADDING {len(rows['commits'])} COMMITS")
+                writer.write_batch("commits", rows["commits"])
+            if rows["workflowruns"]:
+                self.add_workflow_runs(writer, list(rows["workflowruns"].values()))
+
+    def collect(self, data, rows):
         # handle new branch creation
         if data.get("ref_type") == "branch":
-            self.add_branch(data)
+            rows["branches"].append(self.branch_row(data))
         # handle new commit
         if "commits" in data:
-            self.add_commit(data)
-        # handle new workflow run
+            rows["commits"].extend(self.commit_rows(data))
+        # handle new workflow run, requested/in_progress/completed deliveries of the same
+        # run collapse to the one updated last
         if "workflow_run" in data:
-            self.add_workflow_run(data)
-        return "", 200
+            row = self.workflow_run_row(data)
+            newest = rows["workflowruns"].get(row[0])
+            if newest is None or row[5] >= newest[5]:
+                rows["workflowruns"][row[0]] = row
+
+    def add_workflow_runs(self, writer, workflow_run_rows):
+        print(f"ADDING {len(workflow_run_rows)} WORKFLOW RUNS")
+        write_runs(writer, workflow_run_rows)
 
-    def add_commit(self, data):
-        conn = connector(self.password)
-        c = conn.cursor()
-        print("ADDING COMMIT")
-        branch_name = data.get("ref").replace("refs/heads/", "")
-        pusher = data.get("pusher", {}).get("name")
+    def commit_rows(self, data):
+        commit_rows = []
         for commit in data.get("commits", []):
-            commit_hash = commit.get("id")
-            try:
-                author = data.get("author", {}).get("name")
-                commit_time = data.get("author, {}").get("date")
-            except:
-                print(f"No Author found for {commit_hashj}")
-            message = commit.get("message")
-            commit_time = time.mktime(commit_time.timetuple())
-            c.execute(
-                """
-                MERGE INTO commits AS target
-                USING (VALUES (?, ?, ?, ?, ?)) AS source (hash, author, message, time, repo)
-                ON target.hash = source.hash
-                WHEN MATCHED THEN
-                    UPDATE SET 
-                        target.author = source.author, 
-                        target.message = source.message, 
-                        target.time = source.time, 
-                        target.repo = source.repo
-                WHEN NOT MATCHED BY TARGET THEN
-                    INSERT (hash, author, message, time, repo) 
-                    VALUES (source.hash, source.author, source.message, source.time, source.repo);
-                """,
-                (commit_hash, author, message, self.repo_path),
-            )
-        conn.commit()
-        conn.close()
+            commit_rows.append((
+                commit.get("id"),
+                commit.get("author", {}).get("name"),
+                commit.get("message"),
+                parse_time(commit.get("timestamp")),
+                self.repo_path
+            ))
+        return commit_rows
 
-    def add_branch(self, data):
-        conn = connector(self.password)
-        c = conn.cursor()
-        print("ADDING BRANCH")
-        branch_name = data.get("ref")
-        author = data.get("sender", {}).get("login")
-        c.execute(
-            """
-            MERGE INTO branches AS target
-            USING (VALUES (?, ?)) AS source (name, repo)
-            ON target.name = source.name
-            WHEN MATCHED THEN
-                UPDATE SET target.repo = source.repo
-            WHEN NOT MATCHED BY TARGET THEN
-                INSERT (name, repo) VALUES (source.name, source.repo);
-            """,
-            (branch_name, author, self.repo_path),
-        )
-        conn.commit()
-        conn.close()
+    def branch_row(self, data):
+        return (data.get("ref"), self.repo_path)
 
-    def add_workflow_run(self, data):
-        conn = connector(self.password)
-        c = conn.cursor()
-        print("ADDING WORKFLOW RUN")
+    def workflow_run_row(self, data):
         workflow_run = data.get("workflow_run", {})
-        workflow_name = workflow_run.get("name")
-        branch_name = workflow_run.get("head_branch")
-        commit_hash = workflow_run.get("head_sha")
-        author = workflow_run.get("actor", {}).get("login")
-        conclusion = workflow_run.get("conclusion")
+        created_at_dt = parse_time(workflow_run.get("created_at"))
+        updated_at_dt = parse_time(workflow_run.get("updated_at"))
+        started_at_dt = parse_time(workflow_run.get("run_started_at")) or created_at_dt
         status = workflow_run.get("status")
-        gitid = workflow_run.get("id")
-        run_url = workflow_run.get("html_url")
-        created_at_dt = datetime.datetime.fromisoformat(
-            workflow_run.get("created_at").replace("Z", "")
-        )
-        updated_at_dt = datetime.datetime.fromisoformat(
-            workflow_run.get("updated_at").replace("Z", "")
-        )
-        started_at_dt = datetime.datetime.fromisoformat(
-            workflow_run.get("run_started_at").replace("Z", "")
-        )
-        try:
-            runtime = workflow_run.timing().run_duration_ms / 100
-        except:
-            runtime = (updated_at_dt - started_at_dt).total_seconds()
+        runtime = (updated_at_dt - started_at_dt).total_seconds()
         if status == "queued":
             queue_time = (updated_at_dt - created_at_dt).total_seconds()
         else:
             queue_time = (started_at_dt - created_at_dt).total_seconds()
-        c.execute(
-            """
-            MERGE INTO workflowruns AS target
-            USING (VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)) 
-            AS source (gitid, author, runtime, createtime, starttime, endtime, queuetime, status, conclusion, url, branchname, commithash, workflowname, repo)
-            ON target.gitid = source.gitid
-            WHEN MATCHED THEN
-                UPDATE SET 
-                    target.author = source.author,
-                    target.runtime = source.runtime,
-                    target.createtime = source.createtime,
-                    target.starttime = source.starttime,
-                    target.endtime = source.endtime,
-                    target.queuetime = source.queuetime,
-                    target.status = source.status,
-                    target.conclusion = source.conclusion,
-                    target.url = source.url,
-                    target.branchname = source.branchname,
-                    target.commithash = source.commithash,
-                    target.workflowname = source.workflowname,
-                    target.repo = source.repo
-            WHEN NOT MATCHED BY TARGET THEN
-                INSERT (gitid, author, runtime, createtime, starttime, endtime, queuetime, status, conclusion, url, branchname, commithash, workflowname, repo) 
-                VALUES (source.gitid, source.author, source.runtime, source.createtime, source.starttime, source.endtime, source.queuetime, source.status, source.conclusion, source.url, source.branchname, source.commithash, source.workflowname, source.repo);
-            """,
-            (
-                gitid,
-                author,
-                runtime,
-                created_at_dt,
-                started_at_dt,
-                updated_at_dt,
-                queue_time,
-                status,
-                conclusion,
-                run_url,
-                branch_name,
-                commit_hash,
-                workflow_name,
-                self.repo_path
-            ),
+        return (
+            workflow_run.get("id"),
+            (workflow_run.get("actor") or {}).get("login"),
+            runtime,
+            created_at_dt,
+            started_at_dt,
+            updated_at_dt,
+            queue_time,
+            status,
+            workflow_run.get("conclusion"),
+            workflow_run.get("html_url"),
+            workflow_run.get("head_branch"),
+            workflow_run.get("head_sha"),
+            workflow_run.get("name"),
+            self.repo_path
         )
-        conn.commit()
-        conn.close()
-
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="Backend-Listener",
@@ -181,11 +141,15 @@ if __name__ == "__main__":
     parser.add_argument('-k', "--key", help="repository key")
     parser.add_argument('-p', "--port", help="port to expose", default=5000)
     parser.add_argument('-pwd', '--password', help="Password to remote database")
+    parser.add_argument('-s', '--spool', help="directory for the webhook spool", default="spool")
+    parser.add_argument('-db', '--database', help="Local SQLite database file to use instead of the remote database")
     args = parser.parse_args()
     dashboard = Dashboard(
         args.key,
         args.repo,
         args.password,
-        args.port
+        args.port,
+        args.spool,
+        args.database
     )
     dashboard.start()
\ No newline at end of file
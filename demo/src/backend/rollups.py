@@ -0,0 +1,323 @@
+import argparse
+import datetime
+import time
+from bulkwriter import BulkWriter
+from storage import CHUNK, dialect, open_backend
+from sketch import DDSketch
+import archive
+
+# runrollups aggregates completed runs per hour and per day (by create time) for every
+# repo, workflow, branch and author, so the metric cards and trend charts read a few
+# hundred rows instead of scanning workflowruns. Missing branch/author are stored as ''
+PERIODS = ("hour", "day")
+KEYS = ("granularity", "bucketstart", "repo", "workflowname", "branchname", "author")
+COUNTERS = ("runs", "successes", "failures", "cancellations", "queuetimesum", "runtimesum")
+MAXIMA = ("queuetimemax", "runtimemax")
+COLUMNS = KEYS + COUNTERS + MAXIMA
+
+# runsketches keeps a quantile sketch of these run columns per workflow and bucket
+SKETCHED = ("queuetime", "runtime")
+SKETCH_KEYS = ("granularity", "bucketstart", "repo", "workflowname", "metric")
+
+# start of the hour/day a run was created in
+BUCKETS = {
+    "mssql": {
+        "hour": "DATEADD(hour, DATEDIFF(hour, 0, createtime), 0)",
+        "day": "CAST(CAST(createtime AS DATE) AS DATETIME2)",
+    },
+    "sqlite": {
+        "hour": "strftime('%Y-%m-%d %H:00:00', createtime)",
+        "day": "date(createtime) || ' 00:00:00'",
+    },
+}
+
+REBUILD = """
+INSERT INTO runrollups ({columns})
+SELECT '{period}', {bucket}, repo, workflowname, COALESCE(branchname, ''), COALESCE(author, ''),
+    COUNT(*),
+    SUM(CASE WHEN conclusion = 'success' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN conclusion = 'failure' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN conclusion = 'cancelled' THEN 1 ELSE 0 END),
+    SUM(COALESCE(queuetime, 0)), SUM(COALESCE(runtime, 0)),
+    MAX(COALESCE(queuetime, 0)), MAX(COALESCE(runtime, 0))
+FROM {runs}
+WHERE repo = ? AND status = 'completed' AND createtime IS NOT NULL AND workflowname IS NOT NULL
+GROUP BY {bucket}, repo, workflowname, COALESCE(branchname, ''), COALESCE(author, '')
+"""
+
+
+def bucket(period, t):
+    t = t.replace(minute=0, second=0, microsecond=0)
+    return t.replace(hour=0) if period == "day" else t
+
+
+def newly_completed(conn, runs):
+    """
+    The completed runs among workflowruns rows that are not stored as completed yet, live or
+    archived. Called before the rows are upserted so a replayed delivery or a backfill of
+    archived runs is never counted twice
+    """
+    completed = {}
+    for row in runs:
+        gitid, _, _, createtime, _, _, _, status, _, _, _, _, workflowname, _ = row
+        if status == "completed" and createtime is not None and workflowname:
+            completed[gitid] = row
+    gitids = list(completed)
+    c = conn.cursor()
+    for table in (archive.HOT, archive.COLD):
+        for i in range(0, len(gitids), CHUNK):
+            chunk = gitids[i:i + CHUNK]
+            c.execute(
+                f"SELECT gitid FROM {table} WHERE status = 'completed' AND gitid IN ({', '.join('?' for _ in chunk)})",
+                chunk,
+            )
+            for (gitid, ) in c.fetchall():
+                completed.pop(gitid, None)
+    return list(completed.values())
+
+
+def aggregate(runs):
+    """Rollup rows for workflowruns rows, one per (period, bucket, repo, workflow, branch, author)"""
+    buckets = {}
+    for gitid, author, runtime, createtime, _, _, queuetime, _, conclusion, _, branchname, _, workflowname, repo in runs:
+        runtime, queuetime = runtime or 0, queuetime or 0
+        for period in PERIODS:
+            key = (period, bucket(period, createtime), repo, workflowname, branchname or "", author or "")
+            runs_, successes, failures, cancellations, queuetimesum, runtimesum, queuetimemax, runtimemax = buckets.get(key, (0, ) * 8)
+            buckets[key] = (
+                runs_ + 1,
+                successes + (conclusion == "success"),
+                failures + (conclusion == "failure"),
+                cancellations + (conclusion == "cancelled"),
+                queuetimesum + queuetime,
+                runtimesum + runtime,
+                max(queuetimemax, queuetime),
+                max(runtimemax, runtime),
+            )
+    return [key + values for key, values in buckets.items()]
+
+
+def sketches(runs):
+    """{(period, bucket, repo, workflow, metric): DDSketch} of (createtime, repo, workflow, queuetime, runtime) tuples"""
+    sketched = {}
+    for createtime, repo, workflowname, queuetime, runtime in runs:
+        for metric, value in zip(SKETCHED, (queuetime, runtime)):
+            if value is None:
+                continue
+            for period in PERIODS:
+                key = (period, bucket(period, createtime), repo, workflowname, metric)
+                sketched.setdefault(key, DDSketch()).add(value)
+    return sketched
+
+
+def stored_sketches(conn, keys):
+    """
+    {key: sketch json} of the stored sketches among `keys`, read with one range scan per repo
+    (and chunk of workflows) instead of one lookup per key
+    """
+    ranges = {}  # repo -> [first bucket, last bucket, workflows]
+    for _, bucketstart, repo, workflowname, _ in keys:
+        found = ranges.setdefault(repo, [bucketstart, bucketstart, set()])
+        found[0], found[1] = min(found[0], bucketstart), max(found[1], bucketstart)
+        found[2].add(workflowname)
+    stored = {}
+    c = conn.cursor()
+    for repo, (first, last, workflows) in ranges.items():
+        workflows = list(workflows)
+        for i in range(0, len(workflows), CHUNK):
+            chunk = workflows[i:i + CHUNK]
+            c.execute(
+                f"""
+                SELECT {", ".join(SKETCH_KEYS)}, sketch FROM runsketches
+                WHERE repo = ? AND bucketstart >= ? AND bucketstart <= ? AND workflowname IN ({", ".join("?" for _ in chunk)})
+                """,
+                [repo, first, last] + chunk,
+            )
+            for row in c.fetchall():
+                key = tuple(row[:-1])
+                if key in keys:
+                    stored[key] = row[-1]
+    return stored
+
+
+def add_sketches(writer, runs):
+    """Merge freshly completed runs into the stored sketches of their buckets"""
+    values = (
+        (createtime, repo, workflowname, queuetime, runtime)
+        for _, _, runtime, createtime, _, _, queuetime, _, _, _, _, _, workflowname, repo in runs
+    )
+    sketched = sketches(values)
+    if not sketched:
+        return
+    for key, stored in stored_sketches(writer.conn, sketched).items():
+        sketched[key].merge(DDSketch.from_json(stored))
+    writer.write_batch("runsketches", [key + (sketch.to_json(), ) for key, sketch in sketched.items()], commit=False)
+
+
+def add(writer, runs):
+    """
+    Count freshly completed runs into the rollups and sketches, the caller commits. The
+    rollup rows (one per key) are staged and added to the stored counters by one MERGE
+    """
+    rows = aggregate(runs)
+    if rows:
+        writer.write_batch("runrollups", rows, commit=False)
+        add_sketches(writer, runs)
+    return len(rows)
+
+
+def rebuild(conn, repo):
+    """Compaction: recompute every rollup of `repo` from its runs, archived ones included, dropping any drift"""
+    start = time.monotonic()
+    runs = archive.runs(conn)
+    c = conn.cursor()
+    c.execute("DELETE FROM runrollups WHERE repo = ?", (repo, ))
+    rows = 0
+    for period in PERIODS:
+        c.execute(REBUILD.format(columns=", ".join(COLUMNS), period=period, bucket=BUCKETS[dialect(conn)][period], runs=runs), (repo, ))
+        rows += max(c.rowcount or 0, 0)
+    c.execute("DELETE FROM runsketches WHERE repo = ?", (repo, ))
+    c.execute(
+        f"""
+        SELECT createtime, repo, workflowname, queuetime, runtime FROM {runs}
+        WHERE repo = ? AND status = 'completed' AND createtime IS NOT NULL AND workflowname IS NOT NULL
+        """,
+        (repo, ),
+    )
+    sketched = sketches(c.fetchall())
+    if sketched:
+        BulkWriter(conn).write_batch("runsketches", [key + (sketch.to_json(), ) for key, sketch in sketched.items()], commit=False)
+    rows += len(sketched)
+    conn.commit()
+    print(f"runrollups: {rows} rows in {time.monotonic() - start:.1f}s")
+    return rows
+
+
+def compact(conn, keep_hourly=datetime.timedelta(days=14)):
+    """Drop hourly rollups older than `keep_hourly`, the daily ones cover that range"""
+    c = conn.cursor()
+    cutoff = datetime.datetime.utcnow() - keep_hourly
+    c.execute("DELETE FROM runrollups WHERE granularity = 'hour' AND bucketstart < ?", (cutoff, ))
+    rows = c.rowcount
+    c.execute("DELETE FROM runsketches WHERE granularity = 'hour' AND bucketstart < ?", (cutoff, ))
+    conn.commit()
+    return rows + c.rowcount
+
+
+def totals(conn, period, since, repo=None, group_by_bucket=False):
+    """
+    Sums over rollups of `period` from `since` on: (bucket?, runs, successes, failures,
+    cancellations, queuetimesum, runtimesum, queuetimemax, runtimemax)
+    """
+    columns = ", ".join(f"SUM({c})" for c in COUNTERS) + ", " + ", ".join(f"MAX({m})" for m in MAXIMA)
+    where = "granularity = ? AND bucketstart >= ?"
+    params = [period, since]
+    if repo:
+        where += " AND repo = ?"
+        params.append(repo)
+    c = conn.cursor()
+    if group_by_bucket:
+        c.execute(f"SELECT bucketstart, {columns} FROM runrollups WHERE {where} GROUP BY bucketstart ORDER BY bucketstart", params)
+        return c.fetchall()
+    c.execute(f"SELECT {columns} FROM runrollups WHERE {where}", params)
+    return c.fetchone()
+
+
+def queued_runs(conn, since, threshold, repo=None):
+    """(runs queued right now, of which waiting longer than `threshold`) among runs created after `since`"""
+    where = "status = 'queued' AND createtime >= ?"
+    params = [since]
+    if repo:
+        where += " AND repo = ?"
+        params.append(repo)
+    c = conn.cursor()
+    c.execute(
+        f"SELECT COUNT(*), SUM(CASE WHEN createtime < ? THEN 1 ELSE 0 END) FROM workflowruns WHERE {where}",
+        [datetime.datetime.utcnow() - threshold] + params,
+    )
+    queued, exceeding = c.fetchone()
+    return queued or 0, exceeding or 0
+
+
+def percentiles(conn, metric, since, repo=None, workflow=None, quantiles=(0.5, 0.95, 0.99)):
+    """
+    Quantiles of `metric` ("queuetime" or "runtime") over runs created from `since` on, merged
+    from the hourly sketches for windows up to two days and from the daily ones beyond
+    """
+    period = "hour" if datetime.datetime.utcnow() - since <= datetime.timedelta(days=2) else "day"
+    where = "granularity = ? AND bucketstart >= ? AND metric = ?"
+    params = [period, bucket(period, since), metric]
+    if repo:
+        where += " AND repo = ?"
+        params.append(repo)
+    if workflow:
+        where += " AND workflowname = ?"
+        params.append(workflow)
+    c = conn.cursor()
+    c.execute(f"SELECT sketch FROM runsketches WHERE {where}", params)
+    merged = DDSketch()
+    for (stored, ) in c.fetchall():
+        merged.merge(DDSketch.from_json(stored))
+    return [merged.quantile(q) for q in quantiles]
+
+
+def percentile_mins(conn, metric, since, repo=None):
+    p50, p95, p99 = percentiles(conn, metric, since, repo)
+    return {name: round(value / 60, 1) if value is not None else 0 for name, value in (("p50", p50), ("p95", p95), ("p99", p99))}
+
+
+def metrics(conn, repo=None, days=7, threshold_mins=30):
+    """Metric cards and trend series of the dashboard, read from the rollups"""
+    now = datetime.datetime.utcnow()
+    runs, successes, failures, _, queuetimesum, runtimesum, _, _ = totals(conn, "hour", bucket("hour", now) - datetime.timedelta(hours=23), repo)
+    runs = runs or 0
+    queued, exceeding = queued_runs(conn, now - datetime.timedelta(days=1), datetime.timedelta(minutes=threshold_mins), repo)
+    first_day = bucket("day", now) - datetime.timedelta(days=days - 1)
+    history = {row[0]: row for row in totals(conn, "day", first_day, repo, group_by_bucket=True)}
+    dates, avg_queue, max_queue, success, failed = [], [], [], [], []
+    for i in range(days):
+        day = first_day + datetime.timedelta(days=i)
+        _, day_runs, day_successes, day_failures, _, day_queuetime, _, day_queuemax, _ = history.get(day, (day, ) + (0, ) * 8)
+        dates.append(day.strftime('%Y-%m-%d'))
+        avg_queue.append(round(day_queuetime / day_runs / 60, 1) if day_runs else 0)
+        max_queue.append(round(day_queuemax / 60, 1))
+        success.append(day_successes)
+        failed.append(day_failures)
+    return {
+        'queue_metrics': {
+            'current_queued_jobs': queued,
+            'avg_queue_time_mins': round(queuetimesum / runs / 60, 1) if runs else 0,
+            'jobs_exceeding_threshold': exceeding,
+            'threshold_mins': threshold_mins,
+        },
+        'build_metrics': {
+            'total_builds_24h': runs,
+            'failed_builds_24h': failures or 0,
+            'success_rate': round(successes / runs * 100, 1) if runs else 0,
+            'avg_build_time_mins': round(runtimesum / runs / 60, 1) if runs else 0,
+        },
+        'queue_time_percentiles': percentile_mins(conn, "queuetime", bucket("hour", now) - datetime.timedelta(hours=23), repo),
+        'build_time_percentiles': percentile_mins(conn, "runtime", bucket("hour", now) - datetime.timedelta(hours=23), repo),
+        'queue_time_history': {'date': dates, 'avg_queue_time': avg_queue, 'max_queue_time': max_queue},
+        'build_history': {'date': dates, 'success': success, 'failed': failed},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Rollups",
+                                     description="Rebuild and compact the pre-aggregated run metrics")
+    parser.add_argument('-r', '--repo', help="repository to rebuild the rollups of")
+    parser.add_argument('-pwd', '--password', help="Password to remote database")
+    parser.add_argument('-db', '--database', help="Local SQLite database file to use instead of the remote database")
+    parser.add_argument('--keep_hourly', type=int, default=14, help="Days of hourly rollups to keep")
+    args = parser.parse_args()
+
+    backend = open_backend(args.database, args.password)
+    backend.create_schema()
+    with backend.connection() as conn:
+        if args.repo:
+            print("REBUILDING ROLLUPS")
+            rebuild(conn, args.repo)
+        print("COMPACTING ROLLUPS")
+        compact(conn, datetime.timedelta(days=args.keep_hourly))
+    backend.close()
@@ -0,0 +1,210 @@
+import datetime
+import numpy as np
+import archive
+
+# conclusion -> small int code, anything else (still running, skipped, ...) is OTHER
+CONCLUSIONS = ("success", "failure", "cancelled")
+OTHER = len(CONCLUSIONS)
+CODES = {conclusion: code for code, conclusion in enumerate(CONCLUSIONS)}
+SUCCESS, FAILURE, CANCELLED = range(OTHER)
+STATUSES = ("completed", "in_progress", "queued")
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+COMPLETED, QUEUED = STATUS_CODES["completed"], STATUS_CODES["queued"]
+
+DAY = 24 * 60 * 60
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def epoch(t):
+    """Naive UTC datetime (or epoch seconds) -> int epoch seconds"""
+    if isinstance(t, datetime.datetime):
+        if t.tzinfo is not None:
+            t = t.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return int((t - EPOCH).total_seconds())
+    return int(t)
+
+
+class RunArrays:
+    """
+    Workflow runs as parallel NumPy columns sorted by create time: createtime (int64 epoch
+    seconds), queuetime and runtime (float64 seconds, NaN when unknown), conclusion and status
+    (int8 codes) and workflow (int32 index into `workflows`). Loaded once, every metric is then
+    a vectorized mask, bincount or searchsorted over the columns.
+    """
+
+    def __init__(self, createtime, queuetime, runtime, conclusion, status, workflow, workflows):
+        order = np.argsort(createtime, kind="stable")
+        self.createtime = np.asarray(createtime, dtype=np.int64)[order]
+        self.queuetime = np.asarray(queuetime, dtype=np.float64)[order]
+        self.runtime = np.asarray(runtime, dtype=np.float64)[order]
+        self.conclusion = np.asarray(conclusion, dtype=np.int8)[order]
+        self.status = np.asarray(status, dtype=np.int8)[order]
+        self.workflow = np.asarray(workflow, dtype=np.int32)[order]
+        self.workflows = list(workflows)
+
+    def __len__(self):
+        return len(self.createtime)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """From (createtime, queuetime, runtime, conclusion, status, workflowname) tuples"""
+        rows = list(rows)
+        if not rows:
+            return cls([], [], [], [], [], [], [])
+        created, queued, ran, concluded, state, names = zip(*rows)
+        workflows = {}
+        return cls(
+            [epoch(t) for t in created],
+            # None becomes NaN
+            np.array(queued, dtype=np.float64),
+            np.array(ran, dtype=np.float64),
+            [CODES.get(c, OTHER) for c in concluded],
+            [STATUS_CODES.get(s, len(STATUSES)) for s in state],
+            [workflows.setdefault(name, len(workflows)) for name in names],
+            workflows,
+        )
+
+    @classmethod
+    def load(cls, conn, repo=None, since=None, until=None, workflow=None):
+        """The runs of `repo` (all repos by default) created in [since, until), archived ones included, read in one query"""
+        where, params = [], []
+        if repo:
+            where.append("repo = ?")
+            params.append(repo)
+        if since:
+            where.append("createtime >= ?")
+            params.append(since)
+        if until:
+            where.append("createtime < ?")
+            params.append(until)
+        if workflow:
+            where.append("workflowname = ?")
+            params.append(workflow)
+        c = conn.cursor()
+        c.execute(
+            f"SELECT createtime, queuetime, runtime, conclusion, status, workflowname FROM {archive.runs(conn, since, repo)} "
+            + ("WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY createtime",
+            params,
+        )
+        return cls.from_rows(row for row in c.fetchall() if row[0] is not None)
+
+    @classmethod
+    def from_records(cls, records, time_key="timestamp", workflow_key="name"):
+        """From dicts such as the webhook events kept by the debug dashboard"""
+        return cls.from_rows(
+            (r[time_key], r.get("queue_time"), r.get("runtime"), r.get("conclusion"), r.get("status"), r.get(workflow_key))
+            for r in records if r.get(time_key) is not None
+        )
+
+    def where(self, mask):
+        """The runs selected by a boolean mask, still sorted"""
+        subset = RunArrays.__new__(RunArrays)
+        for column in ("createtime", "queuetime", "runtime", "conclusion", "status", "workflow"):
+            setattr(subset, column, getattr(self, column)[mask])
+        subset.workflows = self.workflows
+        return subset
+
+    def window(self, start, end=None):
+        """Slice of the runs created in [start, end), found by binary search"""
+        lo = np.searchsorted(self.createtime, epoch(start), side="left")
+        hi = len(self) if end is None else np.searchsorted(self.createtime, epoch(end), side="left")
+        return slice(lo, hi)
+
+    def counts(self, select=slice(None)):
+        """Runs per conclusion code [success, failure, cancelled, other]"""
+        return np.bincount(self.conclusion[select], minlength=OTHER + 1)
+
+    def success_rate(self, select=slice(None)):
+        counts = self.counts(select)
+        total = counts.sum()
+        return float(counts[SUCCESS] / total * 100) if total else 0.0
+
+    def stats(self, column, select=slice(None), percentiles=(50, 95, 99)):
+        """mean, max and percentiles of a time column, ignoring unknown values"""
+        values = getattr(self, column)[select]
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return {"mean": 0.0, "max": 0.0, **{f"p{p}": 0.0 for p in percentiles}}
+        result = {"mean": float(values.mean()), "max": float(values.max())}
+        result.update((f"p{p}", float(v)) for p, v in zip(percentiles, np.percentile(values, percentiles)))
+        return result
+
+    def daily(self, start, days):
+        """
+        Per-day histograms from the day of `start` on: runs per conclusion code as a
+        (days, 4) array, and the mean and max queue time per day
+        """
+        first = epoch(start) // DAY * DAY
+        select = self.window(first, first + days * DAY)
+        day = (self.createtime[select] - first) // DAY
+        conclusion = self.conclusion[select]
+        histogram = np.bincount(day * (OTHER + 1) + conclusion, minlength=days * (OTHER + 1)).reshape(days, OTHER + 1)
+        queuetime = self.queuetime[select]
+        known = ~np.isnan(queuetime)
+        queued = np.bincount(day[known], minlength=days)
+        queue_sum = np.bincount(day[known], weights=queuetime[known], minlength=days)
+        queue_max = np.zeros(days)
+        np.maximum.at(queue_max, day[known], queuetime[known])
+        queue_mean = np.divide(queue_sum, queued, out=np.zeros(days), where=queued > 0)
+        return histogram, queue_mean, queue_max
+
+    def per_workflow(self, select=slice(None)):
+        """{workflow: (runs, failures, success rate)}"""
+        workflow = self.workflow[select]
+        conclusion = self.conclusion[select]
+        runs = np.bincount(workflow, minlength=len(self.workflows))
+        successes = np.bincount(workflow[conclusion == SUCCESS], minlength=len(self.workflows))
+        failures = np.bincount(workflow[conclusion == FAILURE], minlength=len(self.workflows))
+        return {
+            name: (int(runs[i]), int(failures[i]), float(successes[i] / runs[i] * 100) if runs[i] else 0.0)
+            for i, name in enumerate(self.workflows)
+        }
+
+
+def metrics(runs, now=None, days=7, threshold_mins=30):
+    """
+    Metric cards and trend series of the dashboard, in the shape get_metrics_data returns.
+    Like the rollups, everything but the queued jobs counts completed runs only
+    """
+    now = now or datetime.datetime.utcnow()
+    since = now - datetime.timedelta(days=1)
+    pending = runs.window(since)
+    queued = runs.status[pending] == QUEUED
+    waiting = epoch(now) - runs.createtime[pending]
+    runs = runs.where(runs.status == COMPLETED)
+    last_day = runs.window(since)
+    counts = runs.counts(last_day)
+    total = int(counts.sum())
+    queue = runs.stats("queuetime", last_day)
+    build = runs.stats("runtime", last_day)
+    first_day = now - datetime.timedelta(days=days - 1)
+    histogram, queue_mean, queue_max = runs.daily(first_day, days)
+    start = epoch(first_day) // DAY * DAY
+    dates = [(EPOCH + datetime.timedelta(seconds=int(start + i * DAY))).strftime('%Y-%m-%d') for i in range(days)]
+    return {
+        'queue_metrics': {
+            'current_queued_jobs': int(queued.sum()),
+            'avg_queue_time_mins': round(queue["mean"] / 60, 1),
+            'jobs_exceeding_threshold': int((queued & (waiting > threshold_mins * 60)).sum()),
+            'threshold_mins': threshold_mins,
+        },
+        'build_metrics': {
+            'total_builds_24h': total,
+            'failed_builds_24h': int(counts[FAILURE]),
+            'success_rate': round(float(counts[SUCCESS] / total * 100), 1) if total else 0,
+            'avg_build_time_mins': round(build["mean"] / 60, 1),
+        },
+        'queue_time_percentiles': {p: round(queue[p] / 60, 1) for p in ("p50", "p95", "p99")},
+        'build_time_percentiles': {p: round(build[p] / 60, 1) for p in ("p50", "p95", "p99")},
+        'queue_time_history': {
+            'date': dates,
+            'avg_queue_time': np.round(queue_mean / 60, 1).tolist(),
+            'max_queue_time': np.round(queue_max / 60, 1).tolist(),
+        },
+        'build_history': {
+            'date': dates,
+            'success': histogram[:, SUCCESS].tolist(),
+            'failed': histogram[:, FAILURE].tolist(),
+        },
+    }
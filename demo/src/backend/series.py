@@ -0,0 +1,73 @@
+import datetime
+import numpy as np
+from runarrays import RunArrays, COMPLETED, SUCCESS, FAILURE, EPOCH, epoch
+
+# time series for the trend charts, never more than `points` points whatever the range, so a
+# year of history costs the browser as much as a day. Narrowing the range re-queries it at a
+# finer resolution
+
+
+def lttb(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets: indexes of `points` samples of (x, y) that keep the shape
+    of the line. The first and last samples are kept, every bucket in between contributes the
+    one forming the largest triangle with the previous pick and the next bucket's average
+    """
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)
+    keep = np.empty(points, dtype=np.int64)
+    keep[0], keep[-1] = 0, size - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else size
+        average_x, average_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - average_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (average_y - y[a]))
+        a = lo + int(np.argmax(area)) if hi > lo else a
+        keep[i + 1] = a
+    return np.unique(keep)
+
+
+def minmax(x, y, buckets):
+    """Indexes of the lowest and highest sample in each of `buckets` equal time spans, so spikes survive"""
+    if len(x) <= 2 * buckets:
+        return np.arange(len(x))
+    edges = np.searchsorted(x, np.linspace(x[0], x[-1], buckets + 1)[1:-1])
+    keep = []
+    for lo, hi in zip(np.concatenate(([0], edges)), np.concatenate((edges, [len(x)]))):
+        if hi > lo:
+            keep.append(lo + np.argmin(y[lo:hi]))
+            keep.append(lo + np.argmax(y[lo:hi]))
+    return np.unique(keep)
+
+
+def timestamps(x):
+    return [EPOCH + datetime.timedelta(seconds=int(t)) for t in x]
+
+
+def run_series(conn, column, start, end, points=500, repo=None, workflow=None, method="lttb"):
+    """
+    `column` ("queuetime" or "runtime", in minutes) of the completed runs created in
+    [start, end) downsampled to at most `points` points: (times, values)
+    """
+    runs = RunArrays.load(conn, repo, start, end, workflow)
+    runs = runs.where(runs.status == COMPLETED)
+    values = getattr(runs, column)
+    known = ~np.isnan(values)
+    x, y = runs.createtime[known].astype(np.float64), values[known] / 60
+    keep = lttb(x, y, points) if method == "lttb" else minmax(x, y, points // 2)
+    return timestamps(x[keep]), y[keep].tolist()
+
+
+def outcome_series(conn, start, end, points=500, repo=None, workflow=None):
+    """Successful and failed runs per time bucket over [start, end), at most `points` buckets: (bucket starts, successes, failures)"""
+    runs = RunArrays.load(conn, repo, start, end, workflow)
+    first, last = epoch(start), epoch(end)
+    width = max(-(-(last - first) // points), 1)
+    buckets = -(-(last - first) // width)
+    bucket = (runs.createtime - first) // width
+    successes = np.bincount(bucket[runs.conclusion == SUCCESS], minlength=buckets)[:buckets]
+    failures = np.bincount(bucket[runs.conclusion == FAILURE], minlength=buckets)[:buckets]
+    return timestamps(first + np.arange(buckets) * width), successes.tolist(), failures.tolist()
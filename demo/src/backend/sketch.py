@@ -0,0 +1,98 @@
+import json
+import math
+
+
+class DDSketch:
+    """
+    Mergeable quantile sketch (DDSketch). Values are counted in logarithmic bins so every
+    quantile is returned within `relative_accuracy` of the exact one, and two sketches
+    merge by adding their bins, which is what lets per-bucket sketches answer any window.
+    When there are more than `max_bins` bins the lowest ones are collapsed, the tail
+    quantiles the dashboard shows keep their accuracy.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def index(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        # queue times are clamped at 0, they are never negative in a sane database
+        value = max(value, 0)
+        if value < 1e-9:
+            self.zeros += count
+        else:
+            i = self.index(value)
+            self.bins[i] = self.bins.get(i, 0) + count
+            self.collapse()
+        self.count += count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracies")
+        for i, count in other.bins.items():
+            self.bins[i] = self.bins.get(i, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.collapse()
+        return self
+
+    def collapse(self):
+        if len(self.bins) <= self.max_bins:
+            return
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins
+        lowest = indexes[excess]
+        for i in indexes[:excess]:
+            self.bins[lowest] += self.bins.pop(i)
+
+    def quantile(self, q):
+        """Value at quantile `q` (0..1), None for an empty sketch"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for i in sorted(self.bins):
+            seen += self.bins[i]
+            if seen > rank:
+                return min(max(self.value(i), self.min), self.max)
+        return self.max
+
+    def to_json(self):
+        return json.dumps({
+            "a": self.relative_accuracy,
+            "n": self.max_bins,
+            "z": self.zeros,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "b": self.bins,
+        }, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        sketch = cls(data["a"], data["n"])
+        sketch.bins = {int(i): count for i, count in data["b"].items()}
+        sketch.zeros = data["z"]
+        sketch.count = sketch.zeros + sum(sketch.bins.values())
+        if sketch.count:
+            sketch.min, sketch.max = data["min"], data["max"]
+        return sketch
@@ -0,0 +1,194 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+# every record is a (length, crc32) header followed by the raw payload
+HEADER = struct.Struct(">II")
+
+
+def segment_name(segment):
+    return f"{segment:010d}.spool"
+
+
+def scan(f):
+    """Read the next complete record at the current position, None (position unchanged) if there is none yet"""
+    start = f.tell()
+    header = f.read(HEADER.size)
+    if len(header) == HEADER.size:
+        length, crc = HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) == length and zlib.crc32(payload) == crc:
+            return payload
+    f.seek(start)
+    return None
+
+
+class Spool:
+    """
+    Durable append-only log of raw webhook payloads, split into segment files of about
+    `segment_bytes`. append() returns once the record is fsync'd, so an acknowledged
+    delivery survives a crash of the listener.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+        self.file = open(self.path(self.segment), "ab")
+        self.recover()
+
+    def path(self, segment):
+        return os.path.join(self.directory, segment_name(segment))
+
+    def segments(self):
+        return sorted(int(name.split(".")[0]) for name in os.listdir(self.directory) if name.endswith(".spool"))
+
+    def recover(self):
+        """Cut a record torn by a crash off the end of the active segment"""
+        with open(self.path(self.segment), "rb") as f:
+            while scan(f) is not None:
+                pass
+            end = f.tell()
+        if end != self.file.tell():
+            self.file.truncate(end)
+            os.fsync(self.file.fileno())
+
+    def append(self, payload: bytes):
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            self.file.write(record)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if self.file.tell() >= self.segment_bytes:
+                self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        self.segment += 1
+        self.file = open(self.path(self.segment), "ab")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class SpoolConsumer:
+    """
+    Applies spooled payloads to the database on a background thread. The position of the
+    last applied record is persisted in an offset file after every batch, so a restart
+    resumes where it stopped. Fully applied segments are deleted.
+
+    `apply` receives a list of at most `batch_size` payloads. If it raises one of
+    `retry_on` the batch is retried with backoff, any other error is logged and the batch
+    is skipped so a bad payload cannot block the spool.
+    """
+
+    def __init__(self, spool, apply, batch_size=100, linger=0, poll_interval=0.05, retry_on=(OSError, ), max_backoff=30):
+        self.spool = spool
+        self.apply = apply
+        self.batch_size = batch_size
+        self.linger = linger
+        self.poll_interval = poll_interval
+        self.retry_on = retry_on
+        self.max_backoff = max_backoff
+        self.offset_path = os.path.join(spool.directory, "offset")
+        self.segment, self.position = self.load_offset()
+        self.file = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="spool consumer", daemon=True)
+
+    def load_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                offset = json.load(f)
+            return offset["segment"], offset["position"]
+        except FileNotFoundError:
+            segments = self.spool.segments()
+            return (segments[0] if segments else 1), 0
+
+    def save_offset(self):
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": self.segment, "position": self.position}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.offset_path)
+
+    def open_segment(self):
+        if self.file is None:
+            try:
+                self.file = open(self.spool.path(self.segment), "rb")
+            except FileNotFoundError:
+                return False
+            self.file.seek(self.position)
+        return True
+
+    def read(self):
+        """
+        Read up to batch_size records after the committed offset, returns (payloads, segment, position).
+        Once a record arrives, waits up to `linger` seconds for more so bursts are applied together.
+        """
+        payloads = []
+        deadline = None
+        while len(payloads) < self.batch_size and self.open_segment():
+            payload = scan(self.file)
+            if payload is not None:
+                payloads.append(payload)
+                if deadline is None:
+                    deadline = time.monotonic() + self.linger
+                continue
+            # the writer only moves on after the last record of a segment is complete,
+            # so a newer segment means this one has been read to the end
+            if not any(segment > self.segment for segment in self.spool.segments()):
+                if payloads and time.monotonic() < deadline and not self.stopped.is_set():
+                    self.stopped.wait(self.poll_interval)
+                    continue
+                break
+            if payloads:
+                break
+            self.file.close()
+            self.file = None
+            self.segment += 1
+            self.position = 0
+            self.save_offset()
+            self.cleanup()
+        return payloads, self.segment, self.file.tell() if self.file else 0
+
+    def cleanup(self):
+        for segment in self.spool.segments():
+            if segment < self.segment:
+                os.remove(self.spool.path(segment))
+
+    def run(self):
+        backoff = self.poll_interval
+        while not self.stopped.is_set():
+            payloads, segment, position = self.read()
+            if not payloads:
+                self.stopped.wait(self.poll_interval)
+                continue
+            try:
+                self.apply(payloads)
+            except self.retry_on as e:
+                print(f"Spool apply failed, retrying in {backoff:.1f}s: {e}")
+                self.file.seek(self.position)
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            except Exception as e:
+                print(f"Skipping {len(payloads)} spooled payloads that failed to apply: {e}")
+            backoff = self.poll_interval
+            self.segment, self.position = segment, position
+            self.save_offset()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
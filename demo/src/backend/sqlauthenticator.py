@@ -1,12 +1,139 @@
 import pyodbc
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 
 def connector(pwd):
     server = 'dashboard-backend.database.windows.net'
     database = 'dashboard-backend'
     username = 'CloudSA9134000b'
     password = pwd
-    driver = '{ODBC Driver 17 for SQL Server}' 
+    driver = '{ODBC Driver 17 for SQL Server}'
     connection = pyodbc.connect(
         f'DRIVER={driver};SERVER={server};PORT=1433;DATABASE={database};UID={username};PWD={password}'
     )
-    return connection
\ No newline at end of file
+    return connection
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of warm database connections so callers skip the TLS + login handshake
+
+    minsize: connections opened up front and kept around
+    maxsize: upper bound on open connections, checkout blocks when all are in use
+    idle_timeout: seconds an idle connection beyond minsize is kept before it is closed
+    max_lifetime: seconds after which a connection is replaced, whatever its state
+    ping_after: connections idle for longer than this are checked with SELECT 1 on checkout
+    """
+
+    def __init__(self, pwd, minsize=1, maxsize=10, idle_timeout=300, max_lifetime=1800, ping_after=30, connect=connector):
+        self.pwd = pwd
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.connect = connect
+        self.condition = threading.Condition()
+        self.idle = deque()  # (connection, created, idle since), most recently used last
+        self.size = 0
+        self.closed = False
+        for _ in range(minsize):
+            self.size += 1
+            now = time.monotonic()
+            self.idle.append((connect(pwd), now, now))
+
+    def discard(self, conn):
+        """Close a connection that left the pool, the caller holds the condition"""
+        self.size -= 1
+        self.condition.notify()
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    def reap(self, now):
+        """Close connections idle for longer than idle_timeout, keeping minsize open"""
+        while self.idle and self.size > self.minsize and now - self.idle[0][2] > self.idle_timeout:
+            self.discard(self.idle.popleft()[0])
+
+    def healthy(self, conn, created, idle_since):
+        now = time.monotonic()
+        if now - created > self.max_lifetime:
+            return False
+        if now - idle_since > self.ping_after:
+            try:
+                conn.cursor().execute("SELECT 1").fetchall()
+            except pyodbc.Error:
+                return False
+        return True
+
+    def checkout(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.condition:
+                if self.closed:
+                    raise RuntimeError("Connection pool is closed")
+                self.reap(time.monotonic())
+                if self.idle:
+                    conn, created, idle_since = self.idle.pop()
+                elif self.size < self.maxsize:
+                    self.size += 1
+                    conn = None
+                else:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No database connection available after {timeout}s")
+                    self.condition.wait(remaining)
+                    continue
+            # connecting and pinging happen outside the lock so they never stall other threads
+            if conn is None:
+                try:
+                    return self.connect(self.pwd), time.monotonic()
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+            if self.healthy(conn, created, idle_since):
+                return conn, created
+            with self.condition:
+                self.discard(conn)
+
+    def checkin(self, conn, created, broken=False):
+        if not broken:
+            try:
+                conn.rollback()
+            except pyodbc.Error:
+                broken = True
+        with self.condition:
+            if broken or self.closed:
+                self.discard(conn)
+                return
+            now = time.monotonic()
+            self.idle.append((conn, created, now))
+            self.reap(now)
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Check out a connection for the duration of a with block. Uncommitted work is
+        rolled back on return, connections that raised a database error are replaced.
+        """
+        conn, created = self.checkout(timeout)
+        broken = False
+        try:
+            yield conn
+        except pyodbc.Error:
+            broken = True
+            raise
+        finally:
+            self.checkin(conn, created, broken)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            while self.idle:
+                self.discard(self.idle.pop()[0])
@@ -0,0 +1,102 @@
+import datetime
+import time
+from bulkwriter import TABLES, report
+from storage import top_limit
+import rollups
+import culprits
+import archive
+
+# commit_workflow_status holds the latest run of every workflow on every commit. It is
+# upserted in the same transaction as the runs themselves, so the waterfall and the
+# "is main green" check are primary key reads instead of scans over workflowruns
+RUN_COLUMNS = TABLES["workflowruns"][1]
+STATUS_COLUMNS = TABLES["commit_workflow_status"][1]
+
+REBUILD = """
+INSERT INTO commit_workflow_status ({columns})
+SELECT {columns} FROM (
+    SELECT repo, commithash, workflowname, gitid, status, conclusion, branchname, createtime, endtime,
+        ROW_NUMBER() OVER (PARTITION BY commithash, workflowname ORDER BY createtime DESC, endtime DESC) AS newest
+    FROM {{runs}}
+    WHERE repo = ? AND commithash IS NOT NULL AND workflowname IS NOT NULL
+) AS ranked
+WHERE newest = 1
+""".format(columns=", ".join(STATUS_COLUMNS))
+
+
+def status_rows(run_rows):
+    """commit_workflow_status rows for workflowruns rows, the newest run per (commit, workflow) last"""
+    index = [RUN_COLUMNS.index(column) for column in STATUS_COLUMNS]
+    createtime, endtime = RUN_COLUMNS.index("createtime"), RUN_COLUMNS.index("endtime")
+    commithash = RUN_COLUMNS.index("commithash")
+    # write_batch keeps the last row per key, so order by creation like the guard does
+    never = datetime.datetime.min
+    ordered = sorted(run_rows, key=lambda row: (row[createtime] or never, row[endtime] or never))
+    return [tuple(row[i] for i in index) for row in ordered if row[commithash]]
+
+
+def write_runs(writer, run_rows):
+    """
+    Upsert workflowruns rows, the status matrix, the culprit index and the rollups of newly
+    completed runs in one transaction, returns the runs written. Runs that were archived
+    are updated in the archive
+    """
+    try:
+        rollups.add(writer, rollups.newly_completed(writer.conn, run_rows))
+        cold = archive.archived(writer.conn, [row[0] for row in run_rows])
+        hot = [row for row in run_rows if row[0] not in cold]
+        written = writer.write_batch("workflowruns", hot, commit=False) if hot else 0
+        if cold:
+            written += writer.write_batch(archive.COLD, [row for row in run_rows if row[0] in cold], commit=False)
+        writer.write_batch("commit_workflow_status", status_rows(run_rows), commit=False)
+        culprits.record(writer, run_rows)
+        writer.conn.commit()
+    except Exception:
+        writer.conn.rollback()
+        raise
+    return written
+
+
+def rebuild(conn, repo):
+    """Recompute the status matrix of `repo` from scratch, e.g. after a backfill without it"""
+    start = time.monotonic()
+    c = conn.cursor()
+    c.execute("DELETE FROM commit_workflow_status WHERE repo = ?", (repo, ))
+    c.execute(REBUILD.format(runs=archive.runs(conn)), (repo, ))
+    conn.commit()
+    rows = c.rowcount if c.rowcount is not None and c.rowcount >= 0 else 0
+    report("commit_workflow_status", rows, time.monotonic() - start)
+    return rows
+
+
+def commit_status(conn, repo, commithash, workflows=None):
+    """Latest {workflowname: (conclusion, status)} of a commit"""
+    sql = "SELECT workflowname, conclusion, status FROM commit_workflow_status WHERE repo = ? AND commithash = ?"
+    params = [repo, commithash]
+    if workflows:
+        sql += f" AND workflowname IN ({', '.join('?' for _ in workflows)})"
+        params += list(workflows)
+    c = conn.cursor()
+    c.execute(sql, params)
+    return {workflow: (conclusion, status) for workflow, conclusion, status in c.fetchall()}
+
+
+def is_green(conn, repo, commithash, workflows):
+    """True when every one of `workflows` has succeeded on the commit"""
+    statuses = commit_status(conn, repo, commithash, workflows)
+    return all(statuses.get(workflow, (None, None))[0] == "success" for workflow in workflows)
+
+
+def branch_head(conn, repo, branch):
+    """Commit of the newest run on `branch`, None when nothing ran there"""
+    top, limit = top_limit(conn, 1)
+    c = conn.cursor()
+    c.execute(
+        f"""
+        SELECT {top} commithash FROM commit_workflow_status
+        WHERE repo = ? AND branchname = ? ORDER BY createtime DESC {limit}
+        """,
+        (repo, branch),
+    )
+    row = c.fetchone()
+    return row[0] if row else None
@@ -0,0 +1,358 @@
+import datetime
+import sqlite3
+from contextlib import contextmanager
+
+# times are stored as ISO text in SQLite and come back as datetimes from TIMESTAMP columns
+sqlite3.register_adapter(datetime.datetime, lambda dt: dt.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS branches (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    repo TEXT
+);
+CREATE TABLE IF NOT EXISTS commits (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    author TEXT,
+    message TEXT,
+    time TIMESTAMP,
+    repo TEXT
+);
+CREATE TABLE IF NOT EXISTS workflows (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    url TEXT,
+    repo TEXT
+);
+CREATE TABLE IF NOT EXISTS workflowruns (
+    id INTEGER PRIMARY KEY,
+    gitid INTEGER NOT NULL UNIQUE,
+    author TEXT,
+    runtime REAL,
+    createtime TIMESTAMP,
+    starttime TIMESTAMP,
+    endtime TIMESTAMP,
+    queuetime REAL,
+    status TEXT,
+    conclusion TEXT,
+    url TEXT,
+    branchname TEXT,
+    commithash TEXT,
+    workflowname TEXT,
+    repo TEXT
+);
+-- latest run per (commit, workflow) for the waterfall, covering so it never touches the table
+CREATE INDEX IF NOT EXISTS workflowruns_commit_workflow
+    ON workflowruns (commithash, workflowname, createtime, conclusion, status);
+-- last run of a workflow, e.g. the last push on main
+CREATE INDEX IF NOT EXISTS workflowruns_workflow_end ON workflowruns (workflowname, endtime);
+-- time range scans for metrics
+CREATE INDEX IF NOT EXISTS workflowruns_repo_create ON workflowruns (repo, createtime);
+-- newest commits first
+CREATE INDEX IF NOT EXISTS commits_time ON commits (time);
+-- latest run of every workflow on every commit, maintained with workflowruns
+CREATE TABLE IF NOT EXISTS commit_workflow_status (
+    repo TEXT NOT NULL,
+    commithash TEXT NOT NULL,
+    workflowname TEXT NOT NULL,
+    gitid INTEGER NOT NULL,
+    status TEXT,
+    conclusion TEXT,
+    branchname TEXT,
+    createtime TIMESTAMP,
+    endtime TIMESTAMP,
+    PRIMARY KEY (repo, commithash, workflowname)
+);
+-- newest commit built on a branch
+CREATE INDEX IF NOT EXISTS commit_workflow_status_branch
+    ON commit_workflow_status (repo, branchname, createtime);
+-- matrix entries updated since a refresh, for the live waterfall
+CREATE INDEX IF NOT EXISTS commit_workflow_status_end ON commit_workflow_status (endtime);
+-- hourly and daily aggregates of completed runs, maintained with workflowruns
+CREATE TABLE IF NOT EXISTS runrollups (
+    granularity TEXT NOT NULL,
+    bucketstart TIMESTAMP NOT NULL,
+    repo TEXT NOT NULL,
+    workflowname TEXT NOT NULL,
+    branchname TEXT NOT NULL,
+    author TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    successes INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    cancellations INTEGER NOT NULL,
+    queuetimesum REAL NOT NULL,
+    runtimesum REAL NOT NULL,
+    queuetimemax REAL NOT NULL,
+    runtimemax REAL NOT NULL,
+    PRIMARY KEY (granularity, bucketstart, repo, workflowname, branchname, author)
+);
+-- mergeable quantile sketches (sketch.py) of queue time and runtime per workflow and bucket
+CREATE TABLE IF NOT EXISTS runsketches (
+    granularity TEXT NOT NULL,
+    bucketstart TIMESTAMP NOT NULL,
+    repo TEXT NOT NULL,
+    workflowname TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    sketch TEXT NOT NULL,
+    PRIMARY KEY (granularity, bucketstart, repo, workflowname, metric)
+);
+-- verdict of every workflow on every commit of a branch in commit order (decidedat is the
+-- create time of the run behind it), and the commits where it flips, for culprit finding (culprits.py)
+CREATE TABLE IF NOT EXISTS branchstates (
+    repo TEXT NOT NULL,
+    branchname TEXT NOT NULL,
+    workflowname TEXT NOT NULL,
+    committime TIMESTAMP NOT NULL,
+    commithash TEXT NOT NULL,
+    green INTEGER NOT NULL,
+    decidedat TIMESTAMP NOT NULL,
+    PRIMARY KEY (repo, branchname, workflowname, committime, commithash)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS branchstates_commit
+    ON branchstates (repo, branchname, workflowname, commithash);
+CREATE TABLE IF NOT EXISTS transitions (
+    repo TEXT NOT NULL,
+    branchname TEXT NOT NULL,
+    workflowname TEXT NOT NULL,
+    committime TIMESTAMP NOT NULL,
+    commithash TEXT NOT NULL,
+    green INTEGER NOT NULL,
+    PRIMARY KEY (repo, branchname, workflowname, committime, commithash)
+);
+-- completed runs older than the retention horizon, moved out of workflowruns by archive.py
+CREATE TABLE IF NOT EXISTS workflowrunsarchive (
+    gitid INTEGER NOT NULL PRIMARY KEY,
+    author TEXT,
+    runtime REAL,
+    createtime TIMESTAMP,
+    starttime TIMESTAMP,
+    endtime TIMESTAMP,
+    queuetime REAL,
+    status TEXT,
+    conclusion TEXT,
+    url TEXT,
+    branchname TEXT,
+    commithash TEXT,
+    workflowname TEXT,
+    repo TEXT
+);
+CREATE INDEX IF NOT EXISTS workflowrunsarchive_repo_create ON workflowrunsarchive (repo, createtime);
+-- completed builds of the WebSocket build server, times are epoch seconds like BuildState's
+CREATE TABLE IF NOT EXISTS serverbuilds (
+    id TEXT NOT NULL PRIMARY KEY,
+    repo TEXT NOT NULL,
+    branchname TEXT,
+    commithash TEXT,
+    status TEXT,
+    starttime REAL NOT NULL,
+    endtime REAL,
+    summary TEXT,
+    steps TEXT,
+    seq INTEGER NOT NULL,
+    loglines INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS serverbuilds_repo_start ON serverbuilds (repo, starttime, id);
+CREATE INDEX IF NOT EXISTS serverbuilds_branch_start ON serverbuilds (repo, branchname, starttime, id);
+"""
+
+# the Azure tables are managed on the server, only the indexes and derived tables are created from here
+MSSQL_SCHEMA = """
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'workflowruns_commit_workflow')
+    CREATE INDEX workflowruns_commit_workflow ON workflowruns (commithash, workflowname, createtime)
+    INCLUDE (conclusion, status, author, branchname);
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'workflowruns_workflow_end')
+    CREATE INDEX workflowruns_workflow_end ON workflowruns (workflowname, endtime);
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'workflowruns_repo_create')
+    CREATE INDEX workflowruns_repo_create ON workflowruns (repo, createtime);
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'commits_time')
+    CREATE INDEX commits_time ON commits (time);
+IF OBJECT_ID('commit_workflow_status') IS NULL
+    CREATE TABLE commit_workflow_status (
+        repo NVARCHAR(255) NOT NULL,
+        commithash NVARCHAR(64) NOT NULL,
+        workflowname NVARCHAR(255) NOT NULL,
+        gitid BIGINT NOT NULL,
+        status NVARCHAR(32) NULL,
+        conclusion NVARCHAR(32) NULL,
+        branchname NVARCHAR(255) NULL,
+        createtime DATETIME2 NULL,
+        endtime DATETIME2 NULL,
+        PRIMARY KEY (repo, commithash, workflowname)
+    );
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'commit_workflow_status_branch')
+    CREATE INDEX commit_workflow_status_branch ON commit_workflow_status (repo, branchname, createtime);
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'commit_workflow_status_end')
+    CREATE INDEX commit_workflow_status_end ON commit_workflow_status (endtime);
+IF OBJECT_ID('runrollups') IS NULL
+    CREATE TABLE runrollups (
+        granularity NVARCHAR(8) NOT NULL,
+        bucketstart DATETIME2 NOT NULL,
+        repo NVARCHAR(255) NOT NULL,
+        workflowname NVARCHAR(255) NOT NULL,
+        branchname NVARCHAR(255) NOT NULL,
+        author NVARCHAR(255) NOT NULL,
+        runs INT NOT NULL,
+        successes INT NOT NULL,
+        failures INT NOT NULL,
+        cancellations INT NOT NULL,
+        queuetimesum FLOAT NOT NULL,
+        runtimesum FLOAT NOT NULL,
+        queuetimemax FLOAT NOT NULL,
+        runtimemax FLOAT NOT NULL,
+        PRIMARY KEY (granularity, bucketstart, repo, workflowname, branchname, author)
+    );
+IF OBJECT_ID('runsketches') IS NULL
+    CREATE TABLE runsketches (
+        granularity NVARCHAR(8) NOT NULL,
+        bucketstart DATETIME2 NOT NULL,
+        repo NVARCHAR(255) NOT NULL,
+        workflowname NVARCHAR(255) NOT NULL,
+        metric NVARCHAR(16) NOT NULL,
+        sketch NVARCHAR(MAX) NOT NULL,
+        PRIMARY KEY (granularity, bucketstart, repo, workflowname, metric)
+    );
+IF OBJECT_ID('branchstates') IS NULL
+    CREATE TABLE branchstates (
+        repo NVARCHAR(255) NOT NULL,
+        branchname NVARCHAR(255) NOT NULL,
+        workflowname NVARCHAR(255) NOT NULL,
+        committime DATETIME2 NOT NULL,
+        commithash NVARCHAR(64) NOT NULL,
+        green BIT NOT NULL,
+        decidedat DATETIME2 NOT NULL,
+        PRIMARY KEY (repo, branchname, workflowname, committime, commithash)
+    );
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'branchstates_commit')
+    CREATE UNIQUE INDEX branchstates_commit ON branchstates (repo, branchname, workflowname, commithash);
+IF OBJECT_ID('transitions') IS NULL
+    CREATE TABLE transitions (
+        repo NVARCHAR(255) NOT NULL,
+        branchname NVARCHAR(255) NOT NULL,
+        workflowname NVARCHAR(255) NOT NULL,
+        committime DATETIME2 NOT NULL,
+        commithash NVARCHAR(64) NOT NULL,
+        green BIT NOT NULL,
+        PRIMARY KEY (repo, branchname, workflowname, committime, commithash)
+    );
+IF OBJECT_ID('workflowrunsarchive') IS NULL
+    CREATE TABLE workflowrunsarchive (
+        gitid BIGINT NOT NULL PRIMARY KEY,
+        author NVARCHAR(255) NULL,
+        runtime FLOAT NULL,
+        createtime DATETIME2 NULL,
+        starttime DATETIME2 NULL,
+        endtime DATETIME2 NULL,
+        queuetime FLOAT NULL,
+        status NVARCHAR(32) NULL,
+        conclusion NVARCHAR(32) NULL,
+        url NVARCHAR(512) NULL,
+        branchname NVARCHAR(255) NULL,
+        commithash NVARCHAR(64) NULL,
+        workflowname NVARCHAR(255) NULL,
+        repo NVARCHAR(255) NULL
+    ) WITH (DATA_COMPRESSION = PAGE);
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'workflowrunsarchive_repo_create')
+    CREATE INDEX workflowrunsarchive_repo_create ON workflowrunsarchive (repo, createtime) WITH (DATA_COMPRESSION = PAGE);
+IF OBJECT_ID('serverbuilds') IS NULL
+    CREATE TABLE serverbuilds (
+        id NVARCHAR(255) NOT NULL PRIMARY KEY,
+        repo NVARCHAR(255) NOT NULL,
+        branchname NVARCHAR(255) NULL,
+        commithash NVARCHAR(64) NULL,
+        status NVARCHAR(32) NULL,
+        starttime FLOAT NOT NULL,
+        endtime FLOAT NULL,
+        summary NVARCHAR(MAX) NULL,
+        steps NVARCHAR(MAX) NULL,
+        seq INT NOT NULL,
+        loglines INT NOT NULL
+    );
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'serverbuilds_repo_start')
+    CREATE INDEX serverbuilds_repo_start ON serverbuilds (repo, starttime, id);
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'serverbuilds_branch_start')
+    CREATE INDEX serverbuilds_branch_start ON serverbuilds (repo, branchname, starttime, id);
+"""
+
+
+# SQLite allows 999 parameters per statement, IN lists are sent in chunks of this many keys
+CHUNK = 900
+
+
+def dialect(conn):
+    """SQL dialect spoken by a connection, "sqlite" or "mssql" (Azure SQL)"""
+    return "sqlite" if isinstance(conn, sqlite3.Connection) else "mssql"
+
+
+def top_limit(conn, n="?"):
+    """
+    (TOP, LIMIT) clauses returning at most `n` rows ("?" binds it as a parameter), the one
+    the connection's dialect does not use is empty
+    """
+    if dialect(conn) == "mssql":
+        return f"TOP ({n})", ""
+    return "", f"LIMIT {n}"
+
+
+def connect_sqlite(path):
+    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+class SQLiteBackend:
+    """Dashboard database in a local SQLite file"""
+
+    dialect = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def connection(self):
+        conn = connect_sqlite(self.path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create_schema(self):
+        with self.connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    def close(self):
+        pass
+
+
+class AzureBackend:
+    """Dashboard database on the Azure SQL server, connections come from a ConnectionPool"""
+
+    dialect = "mssql"
+
+    def __init__(self, password, **pool_options):
+        from sqlauthenticator import ConnectionPool
+        self.pool = ConnectionPool(password, **pool_options)
+
+    def connection(self):
+        return self.pool.connection()
+
+    def create_schema(self):
+        with self.connection() as conn:
+            conn.cursor().execute(MSSQL_SCHEMA)
+            conn.commit()
+
+    def close(self):
+        self.pool.close()
+
+
+def open_backend(database=None, password=None, **pool_options):
+    """SQLite backend when a database file is given, the Azure server otherwise"""
+    if database:
+        return SQLiteBackend(database)
+    return AzureBackend(password, **pool_options)
@@ -0,0 +1,174 @@
+import datetime
+import time
+from tqdm import tqdm
+from bulkwriter import report
+from storage import dialect
+
+SCHEMA = {
+    "mssql": """
+    IF OBJECT_ID('syncstate') IS NULL
+    CREATE TABLE syncstate (
+        repo NVARCHAR(255) NOT NULL,
+        tablename NVARCHAR(64) NOT NULL,
+        watermark DATETIME2 NULL,
+        pending DATETIME2 NULL,
+        resumepage INT NULL,
+        updated DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+        PRIMARY KEY (repo, tablename)
+    );
+    """,
+    "sqlite": """
+    CREATE TABLE IF NOT EXISTS syncstate (
+        repo TEXT NOT NULL,
+        tablename TEXT NOT NULL,
+        watermark TIMESTAMP,
+        pending TIMESTAMP,
+        resumepage INTEGER,
+        updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (repo, tablename)
+    );
+    """,
+}
+
+SAVE = {
+    "mssql": """
+    MERGE INTO syncstate AS target
+    USING (VALUES (?, ?, ?, ?, ?)) AS source (repo, tablename, watermark, pending, resumepage)
+    ON target.repo = source.repo AND target.tablename = source.tablename
+    WHEN MATCHED THEN
+        UPDATE SET
+            target.watermark = source.watermark,
+            target.pending = source.pending,
+            target.resumepage = source.resumepage,
+            target.updated = SYSUTCDATETIME()
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT (repo, tablename, watermark, pending, resumepage)
+        VALUES (source.repo, source.tablename, source.watermark, source.pending, source.resumepage);
+    """,
+    "sqlite": """
+    INSERT INTO syncstate (repo, tablename, watermark, pending, resumepage) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (repo, tablename) DO UPDATE SET
+        watermark = excluded.watermark,
+        pending = excluded.pending,
+        resumepage = excluded.resumepage,
+        updated = CURRENT_TIMESTAMP
+    """,
+}
+
+
+def utc(dt):
+    """Normalize GitHub datetimes (aware or naive) to the naive UTC values the database returns"""
+    if dt is not None and dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def parse_time(value):
+    """Parse a GitHub ISO timestamp into the naive UTC datetime stored in the database"""
+    return utc(datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))) if value else None
+
+
+class SyncState:
+    """
+    Per repo, per table checkpoint of an incremental sync
+
+    watermark: everything at or before this time is already in the database
+    pending: the newest time seen by the pass in progress, becomes the watermark when it finishes
+    resumepage: the next page the pass in progress has to fetch, None when no pass is in progress
+    """
+
+    def __init__(self, conn, repo, table):
+        self.conn = conn
+        self.repo = repo
+        self.table = table
+        self.dialect = dialect(conn)
+        c = conn.cursor()
+        c.execute(SCHEMA[self.dialect])
+        c.execute(
+            "SELECT watermark, pending, resumepage FROM syncstate WHERE repo = ? AND tablename = ?",
+            (repo, table),
+        )
+        row = c.fetchone()
+        self.watermark, self.pending, self.resumepage = row if row else (None, None, None)
+        conn.commit()
+
+    def reset(self):
+        self.watermark, self.pending, self.resumepage = None, None, None
+        self.save()
+
+    def checkpoint(self, pending, resumepage):
+        self.pending, self.resumepage = pending, resumepage
+        self.save()
+
+    def finish(self):
+        if self.pending is not None:
+            self.watermark = self.pending
+        self.pending, self.resumepage = None, None
+        self.save()
+
+    def save(self):
+        c = self.conn.cursor()
+        c.execute(
+            SAVE[self.dialect],
+            (self.repo, self.table, self.watermark, self.pending, self.resumepage),
+        )
+        self.conn.commit()
+
+
+def sync(writer, state, table, pages, to_row, time_of, is_final=lambda item: True, floor=None, max_rows=-1, write=None):
+    """
+    Upsert newest-first `pages` into `table` until reaching rows at or before the watermark
+    (or `floor`), checkpointing the next page after every committed batch so a crashed pass
+    resumes where it stopped. Items that are not final yet hold the watermark back so the
+    next pass picks them up again. Returns the number of rows written.
+
+    `write(rows)` commits one batch, by default a plain write_batch into `table`.
+    """
+    write = write or (lambda rows: writer.write_batch(table, rows))
+    bound = max([t for t in (state.watermark, floor) if t is not None], default=None)
+    resuming = state.resumepage is not None
+    newest, hold = state.pending, None
+    buffer = []
+    written = 0
+    reached = limited = False
+    start = time.monotonic()
+    progress = tqdm(total=max_rows if max_rows != -1 else None, desc=f"Adding {table} to DB", unit="rows")
+    for page, items in pages:
+        resume = page + 1
+        for i, item in enumerate(items):
+            if max_rows != -1 and written + len(buffer) >= max_rows:
+                # the rest of this page is picked up again by the next pass
+                limited = True
+                resume = page if i else resume
+                break
+            t = utc(time_of(item))
+            if bound is not None and t <= bound:
+                reached = True
+                break
+            if not resuming and (newest is None or t > newest):
+                newest = t
+            if not is_final(item) and (hold is None or t <= hold):
+                hold = t - datetime.timedelta(microseconds=1)
+            buffer.append(to_row(item))
+        pending = min([t for t in (newest, hold) if t is not None], default=None)
+        limited = limited or (max_rows != -1 and written + len(buffer) >= max_rows)
+        if len(buffer) >= writer.batch_size or reached or limited:
+            if buffer:
+                written += write(buffer)
+                progress.update(len(buffer))
+                buffer = []
+            state.checkpoint(pending, resume)
+        if reached or limited:
+            break
+    else:
+        reached = True
+    if buffer:
+        written += write(buffer)
+        progress.update(len(buffer))
+    progress.close()
+    if reached:
+        # the pass walked all the way down to already synced data
+        state.pending = min([t for t in (newest, hold) if t is not None], default=None)
+        state.finish()
+    report(table, written, time.monotonic() - start)
+    return written
@@ -0,0 +1,62 @@
+import datetime
+import pytest
+from bulkwriter import BulkWriter
+from storage import SQLiteBackend, connect_sqlite
+from statusmatrix import write_runs
+import culprits
+
+START = datetime.datetime(2024, 1, 1)
+
+
+class StrictWriter(BulkWriter):
+    """Rejects empty batches the way pyodbc's fast_executemany does on Azure"""
+
+    def write_batch(self, table, rows, commit=True):
+        assert rows, f"empty batch written to {table}"
+        return super().write_batch(table, rows, commit)
+
+
+@pytest.fixture
+def writer(tmp_path):
+    path = str(tmp_path / "dashboard.db")
+    SQLiteBackend(path).create_schema()
+    conn = connect_sqlite(path)
+    writer = StrictWriter(conn)
+    writer.write_batch("commits", [(f"h{i}", "author", f"commit {i}", START + datetime.timedelta(hours=i), "o/r") for i in range(3)])
+    yield writer
+    conn.close()
+
+
+def run(gitid, commit, conclusion, hours):
+    createtime = START + datetime.timedelta(hours=hours)
+    return (gitid, "author", 60.0, createtime, createtime, createtime + datetime.timedelta(minutes=5), 0.0,
+            "completed", conclusion, "url", "main", f"h{commit}", "CI", "o/r")
+
+
+def stored(writer, table):
+    return writer.conn.execute(f"SELECT commithash, green FROM {table} ORDER BY committime").fetchall()
+
+
+def test_consecutive_green_commits(writer):
+    write_runs(writer, [run(1, 0, "success", 0)])
+    write_runs(writer, [run(2, 1, "success", 1)])
+    assert stored(writer, "branchstates") == [("h0", 1), ("h1", 1)]
+    assert stored(writer, "transitions") == [("h0", 1)]
+    assert culprits.broken_interval(writer.conn, "o/r", "main", "CI") is None
+
+
+def test_stale_batch(writer):
+    write_runs(writer, [run(1, 0, "success", 2)])
+    # an older run of the same commit changes nothing
+    write_runs(writer, [run(2, 0, "failure", 1)])
+    assert stored(writer, "branchstates") == [("h0", 1)]
+    assert stored(writer, "transitions") == [("h0", 1)]
+
+
+def test_break_and_fix(writer):
+    write_runs(writer, [run(1, 0, "success", 0), run(2, 1, "failure", 1)])
+    interval = culprits.broken_interval(writer.conn, "o/r", "main", "CI")
+    assert interval["first_bad"][0] == "h1" and interval["last_good"][0] == "h0"
+    write_runs(writer, [run(3, 2, "success", 2)])
+    assert stored(writer, "transitions") == [("h0", 1), ("h1", 0), ("h2", 1)]
+    assert culprits.broken_interval(writer.conn, "o/r", "main", "CI") is None
@@ -0,0 +1,83 @@
+import asyncio
+import time
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from client import GitHubClient
+from bulkwriter import report
+from storage import dialect
+
+# cache of precise billing timings, one row per run ever fetched (durationms is NULL when
+# GitHub has no timing) so a run is never requested twice
+SCHEMA = {
+    "mssql": """
+    IF OBJECT_ID('runtimings') IS NULL
+    CREATE TABLE runtimings (
+        gitid BIGINT NOT NULL PRIMARY KEY,
+        durationms BIGINT NULL
+    );
+    """,
+    "sqlite": """
+    CREATE TABLE IF NOT EXISTS runtimings (
+        gitid INTEGER NOT NULL PRIMARY KEY,
+        durationms INTEGER
+    );
+    """,
+}
+
+APPLY = {
+    "mssql": """
+    UPDATE w SET w.runtime = t.durationms / 1000.0
+    FROM workflowruns AS w JOIN runtimings AS t ON t.gitid = w.gitid
+    WHERE w.repo = ? AND t.durationms IS NOT NULL AND w.runtime <> t.durationms / 1000.0
+    """,
+    "sqlite": """
+    UPDATE workflowruns SET runtime = t.durationms / 1000.0
+    FROM runtimings AS t
+    WHERE t.gitid = workflowruns.gitid AND workflowruns.repo = ?
+    AND t.durationms IS NOT NULL AND workflowruns.runtime <> t.durationms / 1000.0
+    """,
+}
+
+
+def create_schema(conn):
+    conn.cursor().execute(SCHEMA[dialect(conn)])
+    conn.commit()
+
+
+def missing_timings(conn, repo):
+    """gitids of completed runs of `repo` that have no cached timing yet"""
+    c = conn.cursor()
+    c.execute(
+        """
+        SELECT w.gitid FROM workflowruns AS w
+        WHERE w.repo = ? AND w.status = 'completed'
+        AND NOT EXISTS (SELECT 1 FROM runtimings AS t WHERE t.gitid = w.gitid)
+        """,
+        (repo, ),
+    )
+    return [row[0] for row in c.fetchall()]
+
+
+def apply_timings(conn, repo):
+    """Overwrite the estimated runtime of `repo`'s runs with the cached billing timing"""
+    create_schema(conn)
+    conn.cursor().execute(APPLY[dialect(conn)], (repo, ))
+    conn.commit()
+
+
+def enrich(writer, token, repo, concurrency=8):
+    """Fetch the billing timing of completed runs that lack it and apply every cached timing"""
+    conn = writer.conn
+    create_schema(conn)
+    owner, name = repo.split("/")
+    client = GitHubClient(token)
+    gitids = missing_timings(conn, repo)
+    fetched = 0
+    start = time.monotonic()
+    for i in range(0, len(gitids), writer.batch_size):
+        batch = gitids[i:i + writer.batch_size]
+        durations = asyncio.run(client.get_run_timings(owner, name, batch, concurrency))
+        fetched += writer.write_batch("runtimings", list(durations.items()))
+    report("runtimings", fetched, time.monotonic() - start)
+    apply_timings(conn, repo)
@@ -0,0 +1,117 @@
+from storage import top_limit
+
+# conclusion -> cell symbol, anything else (no run yet, skipped, timed out, ...) is "?"
+STATUS_SYMBOLS = {"success": "0", "failure": "X", "cancelled": "-"}
+
+
+def placeholders(values):
+    return ", ".join("?" for _ in values)
+
+
+def last_run(conn, workflow):
+    """Latest run of `workflow` by end time: (commithash, author, status, conclusion, starttime)"""
+    top, limit = top_limit(conn, 1)
+    c = conn.cursor()
+    c.execute(
+        f"""
+        SELECT {top} commithash, author, status, conclusion, starttime FROM workflowruns
+        WHERE workflowname = ? ORDER BY endtime DESC {limit}
+        """,
+        (workflow, ),
+    )
+    return c.fetchone()
+
+
+def recent_commits_query(conn, columns, limit, branch=None):
+    """SELECT of the `limit` newest commits, optionally only those built on `branch`, and its parameters"""
+    top, bottom = top_limit(conn)
+    where = ""
+    params = []
+    if branch:
+        where = "WHERE EXISTS (SELECT 1 FROM workflowruns AS r WHERE r.commithash = c.hash AND r.branchname = ?)"
+        params.append(branch)
+    sql = f"SELECT {top} {columns} FROM commits AS c {where} ORDER BY c.time DESC {bottom}"
+    return sql, ([limit] + params if top else params + [limit])
+
+
+def recent_commits(conn, limit, branch=None):
+    """The `limit` newest commits as (hash, author, message, time)"""
+    sql, params = recent_commits_query(conn, "c.hash, c.author, c.message, c.time", limit, branch)
+    c = conn.cursor()
+    c.execute(sql, params)
+    return c.fetchall()
+
+
+def latest_runs(conn, workflows, limit, branch=None):
+    """
+    Latest run (by create time) of every workflow on each of the `limit` newest commits, read
+    from the commit_workflow_status matrix by primary key. Returns {(commithash, workflowname): (conclusion, status)}
+    """
+    if not workflows:
+        return {}
+    commits, params = recent_commits_query(conn, "c.hash, c.repo", limit, branch)
+    c = conn.cursor()
+    c.execute(
+        f"""
+        SELECT s.commithash, s.workflowname, s.conclusion, s.status
+        FROM ({commits}) AS recent JOIN commit_workflow_status AS s
+            ON s.repo = recent.repo AND s.commithash = recent.hash
+        WHERE s.workflowname IN ({placeholders(workflows)})
+        """,
+        params + list(workflows),
+    )
+    return {(commit, workflow): (conclusion, status) for commit, workflow, conclusion, status in c.fetchall()}
+
+
+def changed_runs(conn, workflows, since, branch=None):
+    """
+    Matrix entries of `workflows` that changed at or after `since` (an end time cursor, a run's
+    end time moves with every update): [(commithash, workflowname, conclusion, status, endtime)]
+    """
+    if not workflows:
+        return []
+    sql = f"""
+    SELECT commithash, workflowname, conclusion, status, endtime FROM commit_workflow_status
+    WHERE endtime >= ? AND workflowname IN ({placeholders(workflows)})
+    """
+    params = [since] + list(workflows)
+    if branch:
+        sql += " AND branchname = ?"
+        params.append(branch)
+    c = conn.cursor()
+    c.execute(sql, params)
+    return c.fetchall()
+
+
+def latest_change(conn):
+    """End time cursor of the newest update in the matrix, None when it is empty"""
+    # ORDER BY rather than MAX() so SQLite still converts the column to a datetime
+    top, limit = top_limit(conn, 1)
+    c = conn.cursor()
+    c.execute(f"SELECT {top} endtime FROM commit_workflow_status WHERE endtime IS NOT NULL ORDER BY endtime DESC {limit}")
+    row = c.fetchone()
+    return row[0] if row else None
+
+
+def cell(runs, commit, workflow):
+    conclusion, _ = runs.get((commit, workflow), (None, None))
+    return STATUS_SYMBOLS.get(conclusion, "?")
+
+
+def waterfall(conn, workflows, rows=50, branch=None, scan=1000, complete_only=True):
+    """
+    Rows of the waterfall for the newest commits: [(hash, author, message, [symbol per workflow])].
+    Looks at up to `scan` commits, and with `complete_only` keeps only commits every workflow
+    has finished on, like the original script.
+    """
+    commits = recent_commits(conn, scan, branch)
+    runs = latest_runs(conn, workflows, scan, branch)
+    matrix = []
+    for commit_hash, author, message, _ in commits:
+        statuses = [cell(runs, commit_hash, workflow) for workflow in workflows]
+        if complete_only and "?" in statuses:
+            continue
+        matrix.append((commit_hash, author, message, statuses))
+        if len(matrix) >= rows:
+            break
+    return matrix
@@ -0,0 +1,84 @@
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+
+def encode_cursor(key: Tuple[float, str]) -> str:
+    return f"{key[0]!r}:{key[1]}"
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    start_time, build_id = cursor.split(':', 1)
+    return float(start_time), build_id
+
+
+class RecentBuilds:
+    """Build ids of one repository or branch ordered by start time, the newest `capacity` kept"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.keys: List[Tuple[float, str]] = []  # (start_time, build_id), oldest first
+
+    def add(self, start_time: float, build_id: str):
+        insort(self.keys, (start_time, build_id))
+        if len(self.keys) > self.capacity:
+            del self.keys[0]
+
+    def remove(self, start_time: float, build_id: str):
+        i = bisect_left(self.keys, (start_time, build_id))
+        if i < len(self.keys) and self.keys[i] == (start_time, build_id):
+            del self.keys[i]
+
+    def page(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[str], Optional[str]]:
+        """Up to `limit` build ids newest first, from after `cursor` on, and the cursor of the next page"""
+        end = len(self.keys) if cursor is None else bisect_left(self.keys, decode_cursor(cursor))
+        start = max(end - limit, 0)
+        build_ids = [build_id for _, build_id in reversed(self.keys[start:end])]
+        return build_ids, encode_cursor(self.keys[start]) if start > 0 else None
+
+
+class BuildIndex:
+    """
+    Per repository views of the builds, maintained as builds start and complete, so listing
+    a repository's latest, running or per branch builds never looks at other repositories
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.recent: Dict[str, RecentBuilds] = {}  # repository -> RecentBuilds
+        self.branches: Dict[Tuple[str, str], RecentBuilds] = {}  # (repository, branch) -> RecentBuilds
+        self.active: Dict[str, Dict[str, float]] = {}  # repository -> {build_id: start_time} of running builds
+
+    def add(self, build):
+        for index, key in ((self.recent, build.repository), (self.branches, (build.repository, build.branch))):
+            if key not in index:
+                index[key] = RecentBuilds(self.capacity)
+            index[key].add(build.start_time, build.id)
+        self.active.setdefault(build.repository, {})[build.id] = build.start_time
+
+    def complete(self, build):
+        running = self.active.get(build.repository)
+        if running is not None:
+            running.pop(build.id, None)
+            if not running:
+                del self.active[build.repository]
+
+    def remove(self, build):
+        self.complete(build)
+        for index, key in ((self.recent, build.repository), (self.branches, (build.repository, build.branch))):
+            if key in index:
+                index[key].remove(build.start_time, build.id)
+                if not index[key].keys:
+                    del index[key]
+
+    def latest(self, repository: str, limit: int, cursor: Optional[str] = None,
+               branch: Optional[str] = None) -> Tuple[List[str], Optional[str]]:
+        """A page of the newest builds of a repository, or of one of its branches"""
+        recent = self.branches.get((repository, branch)) if branch else self.recent.get(repository)
+        if recent is None:
+            return [], None
+        return recent.page(limit, cursor)
+
+    def running(self, repository: str, limit: Optional[int] = None) -> List[str]:
+        """Running builds of a repository, newest first"""
+        running = self.active.get(repository, {})
+        return sorted(running, key=lambda build_id: (running[build_id], build_id), reverse=True)[:limit]
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.append(str(Path(__file__).parent / "backend"))
+from bulkwriter import BulkWriter, TABLES
+from storage import open_backend, top_limit
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = TABLES['serverbuilds'][1]
+
+
+def build_row(build: dict) -> tuple:
+    """serverbuilds row of a build snapshot"""
+    return (
+        build['id'], build['repository'], build['branch'], build['commit'], build['status'],
+        build['start_time'], build['end_time'], build['summary'], json.dumps(build['steps']),
+        build['seq'], build['log_lines']
+    )
+
+
+def row_build(row: tuple) -> dict:
+    """Build snapshot of a serverbuilds row, without log lines"""
+    build_id, repo, branch, commit, status, start_time, end_time, summary, steps, seq, log_lines = row
+    return {
+        'id': build_id,
+        'repository': repo,
+        'branch': branch,
+        'commit': commit,
+        'status': status,
+        'start_time': start_time,
+        'steps': json.loads(steps) if steps else [],
+        'end_time': end_time,
+        'summary': summary,
+        'seq': seq,
+        'logs': [],
+        'log_offset': log_lines,
+        'log_lines': log_lines
+    }
+
+
+class BuildStore:
+    """
+    Completed builds in the dashboard database. put() only queues a build; run() writes the
+    queue in batches on a worker thread, so the event loop never waits for the database.
+    Reads go through the same thread
+    """
+
+    def __init__(self, backend, batch_size: int = 100, flush_interval: float = 5.0):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending: Dict[str, tuple] = {}  # build_id -> row waiting to be written
+        self.unwritten = set()  # build_ids pending or being written
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.wakeup = asyncio.Event()
+
+    def put(self, build: dict):
+        self.pending[build['id']] = build_row(build)
+        self.unwritten.add(build['id'])
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    def persisted(self, build_id: str) -> bool:
+        return build_id not in self.unwritten
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        while self.pending:
+            batch = dict(islice(self.pending.items(), self.batch_size))
+            for build_id in batch:
+                del self.pending[build_id]
+            try:
+                await loop.run_in_executor(self.executor, self.write, list(batch.values()))
+            except Exception as e:
+                # Retried on the next flush, unless the build was queued again meanwhile
+                logger.error(f"Failed to write {len(batch)} builds: {e}")
+                for build_id, row in batch.items():
+                    self.pending.setdefault(build_id, row)
+                return
+            for build_id in batch:
+                if build_id not in self.pending:
+                    self.unwritten.discard(build_id)
+
+    def write(self, rows: List[tuple]):
+        with self.backend.connection() as conn:
+            BulkWriter(conn).write_batch('serverbuilds', rows)
+
+    async def load(self, build_ids: List[str]) -> Dict[str, dict]:
+        """{build_id: build snapshot} of the stored builds among `build_ids`"""
+        if not build_ids:
+            return {}
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.read, list(build_ids))
+
+    def read(self, build_ids: List[str]) -> Dict[str, dict]:
+        with self.backend.connection() as conn:
+            c = conn.cursor()
+            c.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM serverbuilds WHERE id IN ({', '.join('?' for _ in build_ids)})",
+                build_ids
+            )
+            return {row[0]: row_build(tuple(row)) for row in c.fetchall()}
+
+    async def latest(self, repository: str, limit: int, before: Optional[tuple] = None,
+                     branch: Optional[str] = None) -> List[dict]:
+        """Up to `limit` stored builds of a repository started before the (start_time, build_id) `before`, newest first"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.read_latest, repository, limit, before, branch)
+
+    def read_latest(self, repository: str, limit: int, before: Optional[tuple], branch: Optional[str]) -> List[dict]:
+        where, params = 'repo = ?', [repository]
+        if branch:
+            where += ' AND branchname = ?'
+            params.append(branch)
+        if before:
+            where += ' AND (starttime < ? OR (starttime = ? AND id < ?))'
+            params += [before[0], before[0], before[1]]
+        with self.backend.connection() as conn:
+            top, bottom = top_limit(conn)
+            c = conn.cursor()
+            c.execute(
+                f"SELECT {top} {', '.join(COLUMNS)} FROM serverbuilds WHERE {where} ORDER BY starttime DESC, id DESC {bottom}",
+                [limit] + params if top else params + [limit]
+            )
+            return [row_build(tuple(row)) for row in c.fetchall()]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.backend.close()
+
+
+def open_store(database: Optional[str] = None, password: Optional[str] = None, **options) -> BuildStore:
+    """BuildStore in a local SQLite file, or on the Azure server when only a password is given"""
+    backend = open_backend(database, password)
+    backend.create_schema()
+    return BuildStore(backend, **options)
@@ -1,25 +1,117 @@
 # app/github_client.py
+from collections import deque
 from typing import Optional
 import aiohttp
 import asyncio
+from httpcache import ResponseCache
 
 class GitHubClient:
-    def __init__(self, token: Optional[str] = None):
+    def __init__(self, token: Optional[str] = None, cache: Optional[ResponseCache] = None):
         self.token = token
+        self.cache = cache
         self.base_url = "https://api.github.com"
-        self.headers = {
-            "Accept": "application/vnd.github.v3+json",
-            "Authorization": f"token {token}" if token else None
-        }
+        self.headers = {"Accept": "application/vnd.github.v3+json"}
+        if token:
+            self.headers["Authorization"] = f"token {token}"
+
+    async def get_json(self, session, url: str, params: Optional[dict] = None):
+        """
+        GET a json resource, revalidating the cached copy with If-None-Match when a cache
+        is configured so unchanged resources come back as a 304 from the local store
+        """
+        if not self.cache:
+            async with session.get(url, headers=self.headers, params=params) as response:
+                response.raise_for_status()
+                return await response.json()
+        key = ResponseCache.key(url, params)
+        headers = {**self.headers, **self.cache.validators(key)}
+        async with session.get(url, headers=headers, params=params) as response:
+            if response.status == 304:
+                data = self.cache.get(key)
+                if data is not None:
+                    return data
+            else:
+                response.raise_for_status()
+                data = await response.json()
+                if response.status == 200:
+                    self.cache.store(key, response.headers, data)
+                return data
+        # the entry was evicted between the validators and the 304
+        async with session.get(url, headers=self.headers, params=params) as response:
+            response.raise_for_status()
+            data = await response.json()
+            if response.status == 200:
+                self.cache.store(key, response.headers, data)
+            return data
 
     async def get_workflow_runs(self, owner: str, repo: str):
         async with aiohttp.ClientSession() as session:
             url = f"{self.base_url}/repos/{owner}/{repo}/actions/runs"
-            async with session.get(url, headers=self.headers) as response:
-                return await response.json()
+            return await self.get_json(session, url)
 
     async def get_workflow_jobs(self, owner: str, repo: str, run_id: int):
         async with aiohttp.ClientSession() as session:
             url = f"{self.base_url}/repos/{owner}/{repo}/actions/runs/{run_id}/jobs"
-            async with session.get(url, headers=self.headers) as response:
-                return await response.json()
\ No newline at end of file
+            return await self.get_json(session, url)
+
+    async def get_run_timings(self, owner: str, repo: str, run_ids: list, concurrency: int = 8):
+        """Fetch run_duration_ms for many workflow runs concurrently, None where GitHub has no timing"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(session, run_id):
+            url = f"{self.base_url}/repos/{owner}/{repo}/actions/runs/{run_id}/timing"
+            async with semaphore:
+                async with session.get(url, headers=self.headers) as response:
+                    if response.status == 404:
+                        return run_id, None
+                    response.raise_for_status()
+                    return run_id, (await response.json()).get("run_duration_ms")
+
+        async with aiohttp.ClientSession() as session:
+            return dict(await asyncio.gather(*(fetch(session, run_id) for run_id in run_ids)))
+
+    async def get_page(self, session, url: str, params: dict, page: int):
+        """Fetch one page of a list endpoint, returns (json, last page number)"""
+        async with session.get(url, headers=self.headers, params={**params, "page": page}) as response:
+            response.raise_for_status()
+            last = response.links.get("last")
+            last_page = int(last["url"].query["page"]) if last else page
+            return await response.json(), last_page
+
+    async def iter_pages(self, owner: str, repo: str, endpoint: str, params: Optional[dict] = None,
+                         start: int = 1, concurrency: int = 8, per_page: int = 100):
+        """
+        Yield (page number, json) for every page of a repository list endpoint such as
+        "actions/runs", "commits" or "branches", in order. The first page gives the page
+        count from the Link header, the rest are fetched up to `concurrency` at a time.
+        """
+        url = f"{self.base_url}/repos/{owner}/{repo}/{endpoint}"
+        params = {**(params or {}), "per_page": per_page}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(page):
+            async with semaphore:
+                data, _ = await self.get_page(session, url, params, page)
+                return data
+
+        async with aiohttp.ClientSession() as session:
+            data, last_page = await self.get_page(session, url, params, start)
+            yield start, data
+            # keep a bounded window of requests in flight so pages come back in order
+            # without buffering the whole listing when the consumer is slower. The window
+            # starts small and doubles, so consumers that stop after a few pages (incremental
+            # syncs) do not burn rate limit on pages they never read
+            window = deque()
+            size = 1
+            next_page = start + 1
+            try:
+                while window or next_page <= last_page:
+                    while next_page <= last_page and len(window) < size:
+                        window.append((next_page, asyncio.ensure_future(fetch(next_page))))
+                        next_page += 1
+                    page, task = window.popleft()
+                    yield page, await task
+                    size = min(size * 2, 2 * concurrency)
+            finally:
+                for _, task in window:
+                    task.cancel()
\ No newline at end of file
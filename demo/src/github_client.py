@@ -2,9 +2,11 @@ import requests
 from datetime import datetime, timezone
 from dataclasses import dataclass
 from typing import List, Optional
+from httpcache import ResponseCache
 
 class GitHubClient:
-    def __init__(self, token: Optional[str] = None):
+    def __init__(self, token: Optional[str] = None, cache: Optional[ResponseCache] = None):
+        self.cache = cache
         self.session = requests.Session()
         if token:
             self.session.headers.update({
@@ -13,6 +15,27 @@ class GitHubClient:
             })
         self.base_url = "https://api.github.com"
 
+    def get_json(self, url: str, params: Optional[dict] = None):
+        """
+        GET a json resource, revalidating the cached copy with If-None-Match when a cache
+        is configured so unchanged resources come back as a 304 from the local store
+        """
+        if not self.cache:
+            response = self.session.get(url, params=params)
+            response.raise_for_status()
+            return response.json()
+        key = ResponseCache.key(url, params)
+        response = self.session.get(url, params=params, headers=self.cache.validators(key))
+        if response.status_code == 304:
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+            response = self.session.get(url, params=params)
+        response.raise_for_status()
+        data = response.json()
+        self.cache.store(key, response.headers, data)
+        return data
+
     def get_workflow_runs(self, owner: str, repo: str, branch: Optional[str] = None) -> List[dict]:
         """
         Fetch recent workflow runs from GitHub Actions
@@ -21,9 +44,7 @@ class GitHubClient:
         params = {'branch': branch} if branch else {}
         
         try:
-            response = self.session.get(url, params=params)
-            response.raise_for_status()
-            return response.json().get('workflow_runs', [])
+            return self.get_json(url, params).get('workflow_runs', [])
         except requests.exceptions.RequestException as e:
             print(f"Error fetching workflow runs: {e}")
             return []
@@ -35,9 +56,7 @@ class GitHubClient:
         url = f"{self.base_url}/repos/{owner}/{repo}/actions/runs/{run_id}/jobs"
         
         try:
-            response = self.session.get(url)
-            response.raise_for_status()
-            return response.json().get('jobs', [])
+            return self.get_json(url).get('jobs', [])
         except requests.exceptions.RequestException as e:
             print(f"Error fetching workflow jobs: {e}")
             return []
\ No newline at end of file
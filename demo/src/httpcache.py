@@ -0,0 +1,93 @@
+# app/httpcache.py
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlencode
+
+DEFAULT_PATH = Path.home() / ".cache" / "build-dashboard" / "http.db"
+
+
+class ResponseCache:
+    """
+    On-disk cache of GitHub API responses keyed by url and params. Entries keep the
+    ETag/Last-Modified validators so callers can send conditional requests, a 304 does
+    not count against the rate limit. Least recently used entries are evicted once the
+    stored bodies exceed `max_bytes`.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes: int = 64 * 1024 * 1024):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                lastmodified TEXT,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.db.commit()
+        self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(url: str, params: Optional[dict] = None) -> str:
+        return f"{url}?{urlencode(sorted((params or {}).items()))}"
+
+    def validators(self, key: str) -> dict:
+        """Conditional request headers for a cached response, empty when nothing is cached"""
+        with self.lock:
+            row = self.db.execute("SELECT etag, lastmodified FROM responses WHERE key = ?", (key, )).fetchone()
+        if not row:
+            return {}
+        headers = {}
+        if row[0]:
+            headers["If-None-Match"] = row[0]
+        if row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def get(self, key: str):
+        """Return the cached json for `key` (after a 304) and mark it as recently used"""
+        with self.lock:
+            row = self.db.execute("SELECT body FROM responses WHERE key = ?", (key, )).fetchone()
+            if not row:
+                return None
+            self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+        return json.loads(row[0])
+
+    def store(self, key: str, headers, data):
+        """Cache a 200 response if it carries a validator"""
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        body = json.dumps(data).encode()
+        with self.lock:
+            row = self.db.execute("SELECT size FROM responses WHERE key = ?", (key, )).fetchone()
+            self.total += len(body) - (row[0] if row else 0)
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, etag, lastmodified, body, size, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, etag, last_modified, body, len(body), time.time()),
+            )
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        while self.total > self.max_bytes:
+            row = self.db.execute("SELECT key, size FROM responses ORDER BY accessed LIMIT 1").fetchone()
+            if not row:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (row[0], ))
+            self.total -= row[1]
+
+    def close(self):
+        self.db.close()
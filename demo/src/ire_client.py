@@ -1,6 +1,10 @@
 from github import Github
 from datetime import datetime, timedelta
 import logging
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent / "backend"))
+from runarrays import RunArrays, FAILURE
 
 logger = logging.getLogger(__name__)
 
@@ -36,11 +40,13 @@ class IREEClient:
     def get_build_metrics(self):
         """Calculate build metrics from recent runs"""
         try:
-            runs = list(self.repo.get_workflow_runs())
-            recent_runs = [r for r in runs if datetime.now() - r.created_at < timedelta(hours=24)]
+            runs = RunArrays.from_rows(
+                (r.created_at, None, None, r.conclusion, r.status, r.name) for r in self.repo.get_workflow_runs()
+            )
+            counts = runs.counts(runs.window(datetime.utcnow() - timedelta(hours=24)))
             
-            failed = len([r for r in recent_runs if r.conclusion == 'failure'])
-            total = len(recent_runs)
+            failed = int(counts[FAILURE])
+            total = int(counts.sum())
             
             return {
                 'total_builds_24h': total,
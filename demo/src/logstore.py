@@ -0,0 +1,212 @@
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+INDEX_EVERY = 256  # spilled lines between two entries of a segment's offset index
+SPILL_CHUNK = 256  # lines moved to the segment at once
+
+
+def line_size(line) -> int:
+    return sys.getsizeof(line)
+
+
+class BuildLog:
+    """
+    Log of one build: the newest lines in memory, older ones spilled to an append-only
+    segment file of one JSON encoded line per row. Every INDEX_EVERY-th spilled line has its
+    byte offset indexed, so reading any range seeks close to it instead of scanning the file
+    """
+
+    def __init__(self, path: str, ring_lines: int):
+        self.path = path
+        self.ring_lines = ring_lines
+        self.lines: List = []  # in memory, lines[0] is line number `spilled`
+        self.spilled = 0
+        self.index: List[int] = []
+        self.size = 0  # bytes written to the segment
+        self.memory = 0  # approximate bytes held by self.lines
+
+    def __len__(self):
+        return self.spilled + len(self.lines)
+
+    def append(self, line) -> int:
+        """Add a line, returns its line number"""
+        self.lines.append(line)
+        self.memory += line_size(line)
+        return len(self) - 1
+
+    def spill(self, count: int) -> int:
+        """Move the oldest `count` in-memory lines to the segment, returns the bytes freed"""
+        chunk = self.lines[:count]
+        if not chunk:
+            return 0
+        encoded = []
+        offset = self.size
+        for i, line in enumerate(chunk):
+            if (self.spilled + i) % INDEX_EVERY == 0:
+                self.index.append(offset)
+            row = (json.dumps(line) + '\n').encode()
+            encoded.append(row)
+            offset += len(row)
+        with open(self.path, 'ab') as f:
+            f.write(b''.join(encoded))
+        self.size = offset
+        self.spilled += len(chunk)
+        del self.lines[:len(chunk)]
+        freed = sum(line_size(line) for line in chunk)
+        self.memory -= freed
+        return freed
+
+    def read_spilled(self, start: int, stop: int) -> list:
+        block = start // INDEX_EVERY
+        with open(self.path, 'rb') as f:
+            f.seek(self.index[block])
+            for _ in range(start - block * INDEX_EVERY):
+                f.readline()
+            return [json.loads(f.readline()) for _ in range(stop - start)]
+
+    def range(self, offset: int, count: int) -> list:
+        """Lines offset to offset + count, from the segment and/or memory"""
+        start, stop = max(offset, 0), min(offset + count, len(self))
+        if start >= stop:
+            return []
+        lines = []
+        if start < self.spilled:
+            lines = self.read_spilled(start, min(stop, self.spilled))
+        if stop > self.spilled:
+            lines += self.lines[max(start - self.spilled, 0):stop - self.spilled]
+        return lines
+
+    def tail(self, count: int) -> list:
+        """The last `count` lines"""
+        return self.range(len(self) - count, count)
+
+
+class LogStore:
+    """
+    Logs of all builds. A running build keeps its last `ring_lines` lines (plus up to one
+    SPILL_CHUNK) in memory; when the lines held by all builds exceed `memory_budget` bytes,
+    the builds holding the most spill half of theirs early. Completed builds are on disk only,
+    the offset indexes of the `segment_cache` most recently read ones are kept, and cleanup()
+    deletes segments of evicted builds older than `retention` seconds
+    """
+
+    def __init__(self, directory: str, ring_lines: int = 1000, memory_budget: int = 64 * 1024 * 1024,
+                 segment_cache: int = 256, retention: Optional[float] = 7 * 24 * 3600):
+        self.directory = directory
+        self.ring_lines = ring_lines
+        self.memory_budget = memory_budget
+        self.logs: Dict[str, BuildLog] = {}  # build_id -> BuildLog
+        self.memory = 0
+        self.segments: OrderedDict = OrderedDict()  # build_id -> read-only BuildLog of an evicted build, least recently read first
+        self.segment_cache = segment_cache
+        self.retention = retention
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, build_id: str) -> BuildLog:
+        """Start an empty log for a build, replacing any previous one"""
+        self.remove(build_id)
+        path = self.path(build_id)
+        if os.path.exists(path):
+            os.remove(path)
+        log = self.logs[build_id] = BuildLog(path, self.ring_lines)
+        return log
+
+    def path(self, build_id: str) -> str:
+        return os.path.join(self.directory, quote(build_id, safe='') + '.log')
+
+    def get(self, build_id: str) -> Optional[BuildLog]:
+        return self.logs.get(build_id)
+
+    def segment(self, build_id: str) -> Optional[BuildLog]:
+        """Read-only log of an evicted build, its offset index rebuilt from the segment unless cached"""
+        log = self.segments.get(build_id)
+        if log is not None:
+            self.segments.move_to_end(build_id)
+            return log
+        path = self.path(build_id)
+        if not os.path.exists(path):
+            return None
+        log = BuildLog(path, self.ring_lines)
+        with open(path, 'rb') as f:
+            for row in f:
+                if log.spilled % INDEX_EVERY == 0:
+                    log.index.append(log.size)
+                log.size += len(row)
+                log.spilled += 1
+        self.cache(build_id, log)
+        return log
+
+    def cache(self, build_id: str, log: BuildLog):
+        self.segments[build_id] = log
+        self.segments.move_to_end(build_id)
+        while len(self.segments) > self.segment_cache:
+            self.segments.popitem(last=False)
+
+    def append(self, build_id: str, line) -> int:
+        """Add a line to a build's log, returns its line number"""
+        log = self.logs[build_id]
+        number = log.append(line)
+        self.memory += line_size(line)
+        if len(log.lines) >= log.ring_lines + SPILL_CHUNK:
+            self.memory -= log.spill(SPILL_CHUNK)
+        while self.memory > self.memory_budget:
+            largest = max(self.logs.values(), key=lambda l: l.memory)
+            self.memory -= largest.spill(max(len(largest.lines) // 2, 1))
+        return number
+
+    def finish(self, build_id: str):
+        """Spill a completed build's lines, it is read from its segment from now on"""
+        log = self.logs.get(build_id)
+        if log:
+            self.memory -= log.spill(len(log.lines))
+
+    def evict(self, build_id: str):
+        """Forget a completed build's log, its segment stays readable through segment()"""
+        self.finish(build_id)
+        log = self.logs.pop(build_id, None)
+        if log:
+            self.cache(build_id, log)
+
+    def remove(self, build_id: str):
+        """Forget a build's log and delete its segment"""
+        self.segments.pop(build_id, None)
+        log = self.logs.pop(build_id, None)
+        if log:
+            self.memory -= log.memory
+            if os.path.exists(log.path):
+                os.remove(log.path)
+
+    def cleanup(self) -> int:
+        """Delete the segments of evicted builds last written more than `retention` seconds ago, returns how many"""
+        if self.retention is None:
+            return 0
+        cutoff = time.time() - self.retention
+        live = {log.path for log in self.logs.values()}
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.log') or entry.path in live:
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        if removed:
+            self.segments = OrderedDict(
+                (build_id, log) for build_id, log in self.segments.items() if os.path.exists(log.path))
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            'builds': len(self.logs),
+            'cached_segments': len(self.segments),
+            'memory_bytes': self.memory,
+            'memory_budget_bytes': self.memory_budget
+        }
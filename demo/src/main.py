@@ -12,9 +12,14 @@ import sys
 from pathlib import Path
 from datetime import datetime, timedelta
 import random
+import os
 sys.path.append(str(Path(__file__).parent))
+sys.path.append(str(Path(__file__).parent / "backend"))
 from models import StatusEnum
 from schema import get_sample_workflows
+from storage import connect_sqlite
+from rollups import metrics as rollup_metrics
+from series import run_series, outcome_series
 
 # Styling helpers
 def get_status_color(status: StatusEnum) -> str:
@@ -35,7 +40,19 @@ def style_status(val):
     return f'color: {color};'
 
 def get_metrics_data():
-    # Last 7 days of data
+    # Pre-aggregated rollups of a dashboard database when DASHBOARD_DB points at one
+    database = os.environ.get("DASHBOARD_DB")
+    if database:
+        conn = connect_sqlite(database)
+        try:
+            data = rollup_metrics(conn, os.environ.get("DASHBOARD_REPO"))
+        finally:
+            conn.close()
+        data['queue_time_history'] = pd.DataFrame(data['queue_time_history'])
+        data['build_history'] = pd.DataFrame(data['build_history'])
+        return data
+
+    # Last 7 days of sample data
     dates = [(datetime.now() - timedelta(days=x)).strftime('%Y-%m-%d') for x in range(7)]
     dates.reverse()
     
@@ -52,6 +69,8 @@ def get_metrics_data():
             'success_rate': 92.3,
             'avg_build_time_mins': 45,
         },
+        'queue_time_percentiles': {'p50': 12, 'p95': 41, 'p99': 70},
+        'build_time_percentiles': {'p50': 38, 'p95': 84, 'p99': 112},
         'queue_time_history': pd.DataFrame({
             'date': dates,
             'avg_queue_time': [15, 22, 18, 25, 30, 16, 18],
@@ -64,6 +83,23 @@ def get_metrics_data():
         })
     }
 
+# most points a trend chart gets, whatever the range
+TREND_POINTS = 500
+
+@st.cache_data(ttl=60)
+def get_trend_data(database, repo, start, end, points=TREND_POINTS):
+    """Downsampled queue time and build outcome series of [start, end), re-queried when the range changes"""
+    conn = connect_sqlite(database)
+    try:
+        times, queue_times = run_series(conn, "queuetime", start, end, points, repo)
+        buckets, successes, failures = outcome_series(conn, start, end, points, repo)
+    finally:
+        conn.close()
+    return (
+        pd.DataFrame({'time': times, 'queue_time': queue_times}).set_index('time'),
+        pd.DataFrame({'time': buckets, 'success': successes, 'failed': failures}).set_index('time'),
+    )
+
 def render_metrics_dashboard():
     st.header("📊 Key Metrics")
     
@@ -102,22 +138,48 @@ def render_metrics_dashboard():
             metrics['build_metrics']['avg_build_time_mins']
         )
 
+    # Tail latency over the last 24h
+    p_col1, p_col2 = st.columns(2)
+    with p_col1:
+        queue = metrics['queue_time_percentiles']
+        st.metric("Queue Time p50 / p95 / p99 (mins)", f"{queue['p50']} / {queue['p95']} / {queue['p99']}")
+    with p_col2:
+        build = metrics['build_time_percentiles']
+        st.metric("Build Time p50 / p95 / p99 (mins)", f"{build['p50']} / {build['p95']} / {build['p99']}")
+
     # Charts
+    database = os.environ.get("DASHBOARD_DB")
+    if database:
+        # narrowing the range re-queries it with the same number of points, i.e. zooms in
+        today = datetime.utcnow().date()
+        trend_range = st.date_input("Trend range", (today - timedelta(days=30), today), max_value=today)
+        # while a range is being picked date_input only returns its start
+        start, end = trend_range if len(trend_range) == 2 else (trend_range[0], today)
+        queue_df, build_df = get_trend_data(
+            database,
+            os.environ.get("DASHBOARD_REPO"),
+            datetime.combine(start, datetime.min.time()),
+            datetime.combine(end, datetime.min.time()) + timedelta(days=1),
+        )
+        queue_columns = ['queue_time']
+    else:
+        queue_df = metrics['queue_time_history'].set_index('date')
+        build_df = metrics['build_history'].set_index('date')
+        queue_columns = ['avg_queue_time', 'max_queue_time']
+
     chart_col1, chart_col2 = st.columns(2)
     
     with chart_col1:
         st.subheader("Queue Time Trends")
-        queue_df = metrics['queue_time_history']
         st.line_chart(
-            queue_df.set_index('date')[['avg_queue_time', 'max_queue_time']],
+            queue_df[queue_columns],
             use_container_width=True
         )
 
     with chart_col2:
         st.subheader("Build Success/Failure Trends")
-        build_df = metrics['build_history']
         st.bar_chart(
-            build_df.set_index('date')[['success', 'failed']],
+            build_df[['success', 'failed']],
             use_container_width=True
         )
 
@@ -1,7 +1,7 @@
 import streamlit as st
 import pandas as pd
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from fastapi import FastAPI, Request
 import uvicorn
 import logging
@@ -9,6 +9,10 @@ import requests
 from enum import Enum
 from typing import List, Optional
 from dataclasses import dataclass
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent / "backend"))
+from runarrays import RunArrays, metrics as run_metrics
 
 # Setup logging
 logging.basicConfig(
@@ -40,6 +44,20 @@ class WorkflowData:
     timestamp: datetime
     run_time: Optional[str] = None
     conclusion: Optional[str] = None
+    queue_time: Optional[float] = None  # seconds from creation to start
+    runtime: Optional[float] = None  # seconds from start to the last update
+
+def parse_github_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+def run_durations(workflow_run: dict):
+    """Queue and run time in seconds of a workflow run payload, None where a timestamp is missing"""
+    created_at = parse_github_time(workflow_run.get('created_at'))
+    updated_at = parse_github_time(workflow_run.get('updated_at'))
+    started_at = parse_github_time(workflow_run.get('run_started_at')) or created_at
+    queue_time = (started_at - created_at).total_seconds() if created_at else None
+    runtime = (updated_at - started_at).total_seconds() if updated_at and started_at else None
+    return queue_time, runtime
 
 # Initialize session state
 if 'webhook_data' not in st.session_state:
@@ -81,13 +99,16 @@ async def webhook(request: Request):
             - Started: {workflow_run.get('created_at')}
             """)
             
+            queue_time, runtime = run_durations(workflow_run)
             workflow_data = WorkflowData(
                 name=workflow_run['name'],
                 status=workflow_run['status'],
                 branch=workflow_run['head_branch'],
                 timestamp=datetime.now(),
                 conclusion=workflow_run['conclusion'],
-                run_time=str(workflow_run.get('updated_at', ''))
+                run_time=str(workflow_run.get('updated_at', '')),
+                queue_time=queue_time,
+                runtime=runtime
             )
             
             st.session_state.webhook_data.append(vars(workflow_data))
@@ -139,38 +160,11 @@ def render_debug_panel():
 
 def get_metrics_data():
     """Calculate metrics from webhook data"""
-    webhook_runs = st.session_state.webhook_data
-    
-    # Calculate recent metrics
-    recent_runs = webhook_runs[-50:] if webhook_runs else []  # Last 50 events
-    failed_runs = len([r for r in recent_runs if r['conclusion'] == 'failure'])
-    total_runs = len(recent_runs) if recent_runs else 1
-    
-    # Generate metrics
-    return {
-        'queue_metrics': {
-            'current_queued_jobs': len([r for r in recent_runs if r['status'] == 'queued']),
-            'avg_queue_time_mins': 18,
-            'jobs_exceeding_threshold': 5,
-            'threshold_mins': 30,
-        },
-        'build_metrics': {
-            'total_builds_24h': total_runs,
-            'failed_builds_24h': failed_runs,
-            'success_rate': round(((total_runs - failed_runs) / total_runs * 100), 1),
-            'avg_build_time_mins': 45,
-        },
-        'queue_time_history': pd.DataFrame({
-            'date': [(datetime.now() - timedelta(days=x)).strftime('%Y-%m-%d') for x in range(7)],
-            'avg_queue_time': [15, 22, 18, 25, 30, 16, 18],
-            'max_queue_time': [45, 60, 50, 75, 90, 40, 45]
-        }),
-        'build_history': pd.DataFrame({
-            'date': [(datetime.now() - timedelta(days=x)).strftime('%Y-%m-%d') for x in range(7)],
-            'success': [total_runs - failed_runs] * 7,
-            'failed': [failed_runs] * 7
-        })
-    }
+    runs = RunArrays.from_records(st.session_state.webhook_data)
+    metrics = run_metrics(runs, now=datetime.now())
+    metrics['queue_time_history'] = pd.DataFrame(metrics['queue_time_history'])
+    metrics['build_history'] = pd.DataFrame(metrics['build_history'])
+    return metrics
 
 def render_metrics_dashboard():
     """Render metrics overview dashboard"""
@@ -4,11 +4,13 @@ import asyncio
 from datetime import datetime
 from .database import SessionLocal
 from github_client import GitHubClient
+from httpcache import ResponseCache
 from .models import Workflow, Job, StatusEnum
 
 class WorkflowPoller:
     def __init__(self, github_token: str, poll_interval: int = 60):
-        self.github_client = GitHubClient(github_token)
+        # polls of unchanged runs are answered with a 304 from the local cache
+        self.github_client = GitHubClient(github_token, cache=ResponseCache())
         self.poll_interval = poll_interval
 
     async def poll_workflows(self):
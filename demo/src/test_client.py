@@ -17,6 +17,8 @@ class BuildDashboardClient:
         self.reconnect_delay = 1
         self.max_reconnect_delay = 60
         self.installation_id = config.get('installation_id')
+        self.builds: Dict[str, dict] = {}  # build_id -> build state rebuilt from snapshots and deltas
+        self.resyncing = set()  # build_ids waiting for a build_snapshot
 
     def on(self, event_type: str, callback: Callable):
         """Register a callback for specific event types"""
@@ -37,6 +39,8 @@ class BuildDashboardClient:
                     logger.info("Connected to build dashboard server")
                     self.websocket = websocket
                     self.reconnect_delay = 1  # Reset delay on successful connection
+                    self.builds.clear()  # Subscribing sends fresh snapshots
+                    self.resyncing.clear()
                     
                     # Subscribe to repositories
                     for repo in self.config.get('repositories', []):
@@ -77,6 +81,9 @@ class BuildDashboardClient:
             try:
                 data = json.loads(message)
                 message_type = data.get('type')
+
+                if not await self._apply(data):
+                    continue
                 
                 if message_type in self.callbacks:
                     await self._execute_callback(message_type, data)
@@ -88,6 +95,44 @@ class BuildDashboardClient:
             except Exception as e:
                 logger.error(f"Error handling message: {e}")
 
+    async def _apply(self, data: dict) -> bool:
+        """Update the local build states, False when a delta cannot be applied"""
+        message_type = data.get('type')
+
+        if message_type == 'snapshot':
+            # Replaces the repository's builds, a resync after falling behind may have missed completions
+            for build_id in [i for i, b in self.builds.items() if b['repository'] == data['repository']]:
+                del self.builds[build_id]
+            for build in data['builds']:
+                self.builds[build['id']] = build
+                self.resyncing.discard(build['id'])
+        elif message_type in ('build_started', 'build_snapshot'):
+            self.builds[data['build']['id']] = data['build']
+            self.resyncing.discard(data['build']['id'])
+        elif message_type in ('build_update', 'build_complete'):
+            build_id = data['build_id']
+            build = self.builds.get(build_id)
+            if build is not None and data['seq'] <= build['seq']:
+                return False  # Already applied
+            if build is None or data['seq'] != build['seq'] + 1:
+                # Missed a delta, ask for the whole build once and drop deltas until it arrives
+                if build_id not in self.resyncing:
+                    self.resyncing.add(build_id)
+                    await self.send_message({'type': 'resync', 'build_id': build_id})
+                return False
+            if message_type == 'build_update':
+                build['steps'].extend(data['steps'])
+                build['logs'].extend(data['logs'])
+                build['log_lines'] = data['log_offset'] + len(data['logs'])
+            else:
+                build.update(status=data['status'], end_time=data['end_time'], summary=data['summary'])
+            build['seq'] = data['seq']
+        elif message_type == 'error' and data.get('build_id'):
+            # The server no longer knows a build we asked about, e.g. a resync of an expired one
+            self.resyncing.discard(data['build_id'])
+
+        return True
+
     async def _execute_callback(self, event_type: str, data: dict):
         """Execute callback for event type with error handling"""
         try:
@@ -147,12 +192,16 @@ class BuildDashboardClient:
             **data
         })
 
-    async def query_build(self, build_id: str = None, repository: str = None):
-        """Query build information"""
+    async def query_build(self, build_id: str = None, repository: str = None, **options):
+        """
+        Query build information. With a build_id, log_tail=n or log_offset=i, log_count=n also
+        return log lines; with a repository, branch, running, limit and cursor select the builds
+        """
         await self.send_message({
             'type': 'build_query',
             'build_id': build_id,
-            'repository': repository
+            'repository': repository,
+            **options
         })
 
     async def close(self):
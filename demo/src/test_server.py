@@ -1,18 +1,30 @@
 import asyncio
+import itertools
 import jwt
 import logging
 import json
+import time
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from typing import Dict, Set, Optional
+from typing import Dict, Set, Optional, Tuple
 from dataclasses import dataclass, asdict
 from aiohttp import web
 import aiohttp
 from cryptography.hazmat.primitives import serialization
 import websockets
+from logstore import BuildLog, LogStore
+from buildindex import BuildIndex, decode_cursor, encode_cursor
+from buildstore import open_store
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SNAPSHOT_LOG_LINES = 100  # newest log lines sent with a build snapshot
+MAX_LOG_QUERY_LINES = 10000
+DEFAULT_QUERY_BUILDS = 10
+MAX_QUERY_BUILDS = 100
+RESYNC = object()  # queued in place of the messages dropped for a slow consumer
+
 @dataclass
 class BuildState:
     id: str
@@ -22,9 +34,15 @@ class BuildState:
     status: str
     start_time: float
     steps: list
-    logs: list
     end_time: Optional[float] = None
     summary: Optional[str] = None
+    seq: int = 0  # bumped by every update, so clients can detect missed deltas
+
+@dataclass
+class Fanout:
+    """Delivery of one broadcast, its latency is recorded once every recipient sent or dropped it"""
+    start: float
+    pending: int
 
 class BuildDashboardServer:
     def __init__(self, config: dict):
@@ -32,7 +50,36 @@ class BuildDashboardServer:
         self.connections = {}  # connection_id -> WebSocket
         self.installation_tokens = {}  # installation_id -> {token, expires_at}
         self.build_states = {}  # build_id -> BuildState
+        self.build_index = BuildIndex(config.get('recent_builds_per_repo', 1000))
         self.subscriptions = {}  # connection_id -> Set[repository]
+        self.subscribers = {}  # repository -> Set[connection_id]
+        self.queues = {}  # connection_id -> bounded queue of (payload, Fanout) drained by a writer task
+        self.connection_ids = itertools.count()
+        self.fanout_latencies = deque(maxlen=config.get('fanout_latency_samples', 1000))
+        # What to do when a connection's queue is full: 'snapshot' drops its queued deltas
+        # and sends fresh snapshots instead, 'disconnect' closes it
+        self.slow_consumer_policy = config.get('slow_consumer_policy', 'snapshot')
+        # Completed builds are written to the database ('database' SQLite file, or the Azure
+        # server with 'database_password') and evicted from memory once written and either
+        # older than build_ttl seconds or beyond max_completed_builds. Without a database
+        # they stay in memory
+        self.store = None
+        if config.get('database') or config.get('database_password'):
+            self.store = open_store(config.get('database'), config.get('database_password'),
+                                    batch_size=config.get('store_batch_size', 100),
+                                    flush_interval=config.get('store_flush_interval', 5.0))
+        self.completed = OrderedDict()  # build_id -> time completed, oldest first
+        self.build_ttl = config.get('build_ttl', 15 * 60)
+        self.max_completed_builds = config.get('max_completed_builds', 1000)
+        self.tasks = []  # background tasks started by start(), cancelled on shutdown
+        self.logs = LogStore(
+            config.get('log_dir', 'build-logs'),
+            config.get('log_ring_lines', 1000),
+            config.get('log_memory_budget', 64 * 1024 * 1024),
+            config.get('log_segment_cache', 256),
+            # Seconds the logs of evicted builds are kept on disk, None keeps them forever
+            config.get('log_retention', 7 * 24 * 3600)
+        )
         
         # Load GitHub App private key
         with open(config['github_private_key_path'], 'rb') as key_file:
@@ -110,9 +157,11 @@ class BuildDashboardServer:
                 return
 
             # Set up connection
-            connection_id = str(len(self.connections))
+            connection_id = str(next(self.connection_ids))
             self.connections[connection_id] = websocket
             self.subscriptions[connection_id] = set()
+            self.queues[connection_id] = asyncio.Queue(maxsize=self.config.get('send_queue_size', 256))
+            writer = asyncio.create_task(self.connection_writer(connection_id, websocket))
 
             logger.info(f"New connection established: {connection_id}")
 
@@ -124,8 +173,14 @@ class BuildDashboardServer:
             logger.info(f"Connection closed: {connection_id}")
         finally:
             if connection_id:
+                writer.cancel()
                 self.connections.pop(connection_id, None)
-                self.subscriptions.pop(connection_id, None)
+                for repository in self.subscriptions.pop(connection_id, set()):
+                    self.unsubscribe(connection_id, repository)
+                queue = self.queues.pop(connection_id, None)
+                while queue is not None and not queue.empty():
+                    _, fanout = queue.get_nowait()
+                    self.fanout_done(fanout)
 
     async def handle_message(self, connection_id: str, installation_id: int, message: str):
         try:
@@ -137,7 +192,8 @@ class BuildDashboardServer:
                 'build_update': self.handle_build_update,
                 'build_complete': self.handle_build_complete,
                 'build_query': self.handle_build_query,
-                'subscription': self.handle_subscription
+                'subscription': self.handle_subscription,
+                'resync': self.handle_resync
             }
 
             if msg_type in handlers:
@@ -168,14 +224,18 @@ class BuildDashboardServer:
             commit=commit,
             status='started',
             start_time=datetime.utcnow().timestamp(),
-            steps=[],
-            logs=[]
+            steps=[]
         )
 
+        if build_id in self.build_states:
+            self.build_index.remove(self.build_states[build_id])
+            self.completed.pop(build_id, None)
         self.build_states[build_id] = build_state
+        self.build_index.add(build_state)
+        self.logs.open(build_id)
         await self.broadcast_build_update(repository, {
             'type': 'build_started',
-            'build': asdict(build_state)
+            'build': self.build_snapshot(build_state)
         })
         
         await self.create_github_check_run(installation_id, build_state)
@@ -188,20 +248,32 @@ class BuildDashboardServer:
             await self.send_error(connection_id, 'Build not found')
             return
 
+        # Only what this update adds is broadcast, clients apply it to their snapshot
+        build_state.seq += 1
+        delta = {
+            'type': 'build_update',
+            'build_id': build_id,
+            'repository': build_state.repository,
+            'seq': build_state.seq,
+            'steps': [],
+            'logs': [],
+            'log_offset': len(self.logs.get(build_id))
+        }
+
         if 'step' in data:
-            build_state.steps.append({
+            step = {
                 'step': data['step'],
                 'status': data.get('status'),
                 'timestamp': datetime.utcnow().timestamp()
-            })
+            }
+            build_state.steps.append(step)
+            delta['steps'].append(step)
 
         if 'log' in data:
-            build_state.logs.append(data['log'])
+            self.logs.append(build_id, data['log'])
+            delta['logs'].append(data['log'])
 
-        await self.broadcast_build_update(build_state.repository, {
-            'type': 'build_update',
-            'build': asdict(build_state)
-        })
+        await self.broadcast_build_update(build_state.repository, delta)
 
         await self.update_github_check_run(installation_id, build_state)
 
@@ -216,10 +288,23 @@ class BuildDashboardServer:
         build_state.status = data.get('status', 'completed')
         build_state.end_time = datetime.utcnow().timestamp()
         build_state.summary = data.get('summary')
+        build_state.seq += 1
+        self.build_index.complete(build_state)
+        self.logs.finish(build_id)
+        # A build completed again moves to the back, eviction goes oldest first
+        self.completed.pop(build_id, None)
+        self.completed[build_id] = time.monotonic()
+        if self.store:
+            self.store.put(self.build_snapshot(build_state, log_lines=0))
 
         await self.broadcast_build_update(build_state.repository, {
             'type': 'build_complete',
-            'build': asdict(build_state)
+            'build_id': build_id,
+            'repository': build_state.repository,
+            'seq': build_state.seq,
+            'status': build_state.status,
+            'end_time': build_state.end_time,
+            'summary': build_state.summary
         })
 
         await self.complete_github_check_run(installation_id, build_state)
@@ -230,25 +315,69 @@ class BuildDashboardServer:
 
         if build_id:
             build_state = self.build_states.get(build_id)
+            if build_state:
+                build = self.build_snapshot(build_state)
+                log = self.logs.get(build_id)
+            else:
+                build, log = await self.stored_build(build_id)
             response = {
                 'type': 'build_query_response',
-                'build': asdict(build_state) if build_state else None
+                'build': build
             }
+            # Older log lines on demand: 'log_tail': n or 'log_offset' (+ 'log_count')
+            if log is not None and ('log_tail' in data or 'log_offset' in data):
+                if 'log_offset' in data:
+                    offset = max(int(data['log_offset']), 0)
+                    lines = log.range(offset, min(int(data.get('log_count', MAX_LOG_QUERY_LINES)), MAX_LOG_QUERY_LINES))
+                else:
+                    lines = log.tail(min(int(data['log_tail']), MAX_LOG_QUERY_LINES))
+                    offset = len(log) - len(lines)
+                response['logs'] = {'offset': offset, 'lines': lines, 'total': len(log)}
         elif repository:
+            # Latest builds newest first, 'branch' narrows them, 'running' lists the running
+            # ones, 'cursor' is the next_cursor of the previous page
+            limit = min(int(data.get('limit') or DEFAULT_QUERY_BUILDS), MAX_QUERY_BUILDS)
+            if data.get('running'):
+                build_ids, next_cursor = self.build_index.running(repository, limit), None
+            else:
+                build_ids, next_cursor = self.build_index.latest(
+                    repository, limit, data.get('cursor'), data.get('branch'))
+            evicted = [i for i in build_ids if i not in self.build_states]
+            stored = await self.store.load(evicted) if self.store else {}
             builds = [
-                asdict(build) for build in self.build_states.values()
-                if build.repository == repository
+                self.build_snapshot(self.build_states[i], log_lines=0) if i in self.build_states else stored[i]
+                for i in build_ids if i in self.build_states or i in stored
             ]
-            builds.sort(key=lambda x: x['start_time'], reverse=True)
+            if self.store and not data.get('running') and next_cursor is None and len(build_ids) < limit:
+                # Past the oldest indexed build, continue with the stored ones
+                if builds:
+                    before = (builds[-1]['start_time'], builds[-1]['id'])
+                else:
+                    before = decode_cursor(data['cursor']) if data.get('cursor') else None
+                older = await self.store.latest(repository, limit - len(build_ids), before, data.get('branch'))
+                builds += older
+                if len(older) == limit - len(build_ids):
+                    next_cursor = encode_cursor((older[-1]['start_time'], older[-1]['id']))
+            response = {
+                'type': 'build_query_response',
+                'builds': builds,
+                'next_cursor': next_cursor
+            }
+        elif data.get('log_stats'):
             response = {
                 'type': 'build_query_response',
-                'builds': builds[:10]  # Latest 10 builds
+                'log_stats': self.logs.stats()
+            }
+        elif data.get('fanout_stats'):
+            response = {
+                'type': 'build_query_response',
+                'fanout_stats': self.fanout_stats()
             }
         else:
             await self.send_error(connection_id, 'Missing build_id or repository')
             return
 
-        await self.connections[connection_id].send(json.dumps(response))
+        self.send(connection_id, json.dumps(response))
 
     async def handle_subscription(self, connection_id: str, installation_id: int, data: dict):
         repository = data.get('repository')
@@ -260,25 +389,172 @@ class BuildDashboardServer:
 
         if action == 'subscribe':
             self.subscriptions[connection_id].add(repository)
+            self.subscribers.setdefault(repository, set()).add(connection_id)
+            # Full state of the running builds once, deltas from then on
+            self.send(connection_id, json.dumps(self.repository_snapshot(repository)))
         else:
             self.subscriptions[connection_id].discard(repository)
+            self.unsubscribe(connection_id, repository)
+
+    def unsubscribe(self, connection_id: str, repository: str):
+        subscribers = self.subscribers.get(repository)
+        if subscribers is not None:
+            subscribers.discard(connection_id)
+            if not subscribers:
+                del self.subscribers[repository]
+
+    def repository_snapshot(self, repository: str) -> dict:
+        return {
+            'type': 'snapshot',
+            'repository': repository,
+            'builds': [
+                self.build_snapshot(self.build_states[build_id])
+                for build_id in self.build_index.running(repository)
+            ]
+        }
+
+    async def handle_resync(self, connection_id: str, installation_id: int, data: dict):
+        """Resend the full state of a build to a client that missed a delta"""
+        build_id = data.get('build_id')
+        build_state = self.build_states.get(build_id)
+        if build_state:
+            build = self.build_snapshot(build_state)
+        else:
+            build, _ = await self.stored_build(build_id)
+
+        if not build:
+            # The build_id lets the client stop waiting for the snapshot
+            await self.send_error(connection_id, 'Build not found', build_id=build_id)
+            return
+
+        self.send(connection_id, json.dumps({
+            'type': 'build_snapshot',
+            'build': build
+        }))
+
+    async def stored_build(self, build_id: str) -> Tuple[Optional[dict], Optional[BuildLog]]:
+        """Snapshot and log of a build evicted from memory (or from before a restart), Nones if unknown"""
+        if not self.store or not build_id:
+            return None, None
+        build = (await self.store.load([build_id])).get(build_id)
+        log = self.logs.segment(build_id) if build else None
+        if log is not None:
+            build['logs'] = log.tail(SNAPSHOT_LOG_LINES)
+            build['log_offset'] = len(log) - len(build['logs'])
+        return build, log
+
+    def build_snapshot(self, build_state: BuildState, log_lines: int = SNAPSHOT_LOG_LINES) -> dict:
+        """The build with its newest `log_lines` log lines, older ones are queried by offset"""
+        log = self.logs.get(build_state.id)
+        lines = log.tail(log_lines) if log is not None and log_lines else []
+        total = len(log) if log is not None else 0
+        return {
+            **asdict(build_state),
+            'logs': lines,
+            'log_offset': total - len(lines),
+            'log_lines': total
+        }
 
     async def broadcast_build_update(self, repository: str, message: dict):
-        for conn_id, subscribed_repos in self.subscriptions.items():
-            if repository in subscribed_repos:
-                try:
-                    await self.connections[conn_id].send(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Failed to send to {conn_id}: {e}")
-
-    async def send_error(self, connection_id: str, message: str):
+        subscribers = self.subscribers.get(repository)
+        if not subscribers:
+            return
+        # Serialized once, each connection's writer task sends it at its own pace
+        payload = json.dumps(message)
+        fanout = Fanout(start=time.perf_counter(), pending=len(subscribers))
+        for conn_id in list(subscribers):
+            self.send(conn_id, payload, fanout)
+
+    def send(self, connection_id: str, payload: str, fanout: Optional[Fanout] = None) -> bool:
+        """Queue a message for a connection without waiting, False if it was dropped"""
+        queue = self.queues.get(connection_id)
+        if queue is None:
+            self.fanout_done(fanout)
+            return False
         try:
-            await self.connections[connection_id].send(json.dumps({
-                'type': 'error',
-                'message': message
-            }))
-        except Exception as e:
-            logger.error(f"Failed to send error to {connection_id}: {e}")
+            queue.put_nowait((payload, fanout))
+            return True
+        except asyncio.QueueFull:
+            self.fanout_done(fanout)
+            if not self.handle_slow_consumer(connection_id) or fanout is not None:
+                return False
+        # A reply to the connection's own request, queued again behind the resync
+        try:
+            queue.put_nowait((payload, None))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def handle_slow_consumer(self, connection_id: str) -> bool:
+        """Make room in a full send queue, False if the connection was closed instead"""
+        queue = self.queues[connection_id]
+        if self.slow_consumer_policy == 'snapshot':
+            # Queued deltas are superseded by snapshots taken when the writer gets to them,
+            # replies to the connection's own requests are kept
+            replies = []
+            while not queue.empty():
+                payload, fanout = queue.get_nowait()
+                if fanout is not None:
+                    self.fanout_done(fanout)
+                elif payload is not RESYNC:
+                    replies.append(payload)
+            if len(replies) < queue.maxsize:
+                logger.warning(f"Send queue of {connection_id} full, resyncing it with snapshots")
+                for payload in replies:
+                    queue.put_nowait((payload, None))
+                queue.put_nowait((RESYNC, None))
+                return True
+            # Not even reading the replies to its own requests
+
+        logger.warning(f"Disconnecting slow consumer {connection_id}")
+        websocket = self.connections.get(connection_id)
+        self.queues.pop(connection_id, None)
+        if websocket is not None:
+            asyncio.ensure_future(websocket.close(1008, 'Consumer too slow'))
+        return False
+
+    async def connection_writer(self, connection_id: str, websocket):
+        queue = self.queues[connection_id]
+        while True:
+            payload, fanout = await queue.get()
+            try:
+                if payload is RESYNC:
+                    for repository in list(self.subscriptions.get(connection_id, ())):
+                        await websocket.send(json.dumps(self.repository_snapshot(repository)))
+                else:
+                    await websocket.send(payload)
+            except websockets.exceptions.ConnectionClosed:
+                return
+            except Exception as e:
+                logger.error(f"Failed to send to {connection_id}: {e}")
+            finally:
+                self.fanout_done(fanout)
+
+    def fanout_done(self, fanout: Optional[Fanout]):
+        if fanout is None:
+            return
+        fanout.pending -= 1
+        if fanout.pending == 0:
+            self.fanout_latencies.append(time.perf_counter() - fanout.start)
+
+    def fanout_stats(self) -> dict:
+        """Time from broadcast until every subscriber sent the message, over recent messages"""
+        latencies = sorted(self.fanout_latencies)
+        if not latencies:
+            return {'messages': 0}
+        return {
+            'messages': len(latencies),
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'p99_ms': latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000,
+            'max_ms': latencies[-1] * 1000
+        }
+
+    async def send_error(self, connection_id: str, message: str, **details):
+        self.send(connection_id, json.dumps({
+            'type': 'error',
+            'message': message,
+            **details
+        }))
 
     async def create_github_check_run(self, installation_id: int, build_state: BuildState):
         token = await self.get_installation_token(installation_id)
@@ -304,22 +580,65 @@ class BuildDashboardServer:
                 if response.status != 201:
                     logger.error(f"Failed to create check run: {await response.text()}")
 
+    def evict_builds(self):
+        """Drop completed builds that are written to the store and expired or over the cap from memory"""
+        now = time.monotonic()
+        while self.completed:
+            build_id, completed_at = next(iter(self.completed.items()))
+            if now - completed_at < self.build_ttl and len(self.completed) <= self.max_completed_builds:
+                break
+            if not self.store.persisted(build_id):
+                break  # Not written yet, neither are the ones completed after it
+            del self.completed[build_id]
+            self.build_states.pop(build_id, None)
+            self.logs.evict(build_id)
+
+    async def run_eviction(self):
+        while True:
+            await asyncio.sleep(self.config.get('eviction_interval', 10))
+            self.evict_builds()
+
+    async def run_log_cleanup(self):
+        while True:
+            removed = self.logs.cleanup()
+            if removed:
+                logger.info(f"Deleted {removed} expired build logs")
+            await asyncio.sleep(self.config.get('log_cleanup_interval', 3600))
+
     async def start(self):
-        server = await websockets.serve(
-            self.handle_websocket,
-            self.config['host'],
-            self.config['port']
-        )
-        
-        logger.info(f"Server started on ws://{self.config['host']}:{self.config['port']}")
-        await server.wait_closed()
+        if self.store:
+            self.tasks += [asyncio.create_task(self.store.run()), asyncio.create_task(self.run_eviction())]
+        self.tasks.append(asyncio.create_task(self.run_log_cleanup()))
+        try:
+            server = await websockets.serve(
+                self.handle_websocket,
+                self.config['host'],
+                self.config['port']
+            )
+
+            logger.info(f"Server started on ws://{self.config['host']}:{self.config['port']}")
+            await server.wait_closed()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """Cancel the background tasks and write the builds still queued for the store"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.store:
+            await self.store.flush()
+            self.store.close()
 
 if __name__ == "__main__":
     config = {
         'host': 'localhost',
         'port': 8080,
         'github_app_id': '<enter app id>',
-        'github_private_key_path': '<enter path/to/private-key.pem>'
+        'github_private_key_path': '<enter path/to/private-key.pem>',
+        # Completed builds are written here and evicted from memory, e.g. the file given to local-database.py -db
+        'database': '<enter path/to/dashboard.db>'
     }
     
     server = BuildDashboardServer(config)
@@ -1,73 +1,145 @@
-import numpy as np
-import sqlite3
 import datetime, time
 from colorama import Fore, Back, Style
 import re
 import argparse
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent / "src" / "backend"))
+from storage import connect_sqlite
+from waterfall import STATUS_SYMBOLS, last_run, waterfall, changed_runs, latest_change
+from culprits import blame
 
-def find_last_main_push(c):
-    c.execute("SELECT archivedcommithash, author, status, conclusion, starttime FROM workflowruns WHERE archivedworkflowname = 'Push on main' ORDER BY endtime DESC LIMIT 1")
-    results = c.fetchall()
-    return results
+workflow_runs_monitered = ['Push on main', 'PkgCI', 'CI', 'samples', 'CI - Windows x64 MSVC', 'Publish Website', 'CI - Linux arm64 clang']
 
 parser = argparse.ArgumentParser(prog="waterfall",
                                      description="show history of build failures")
 parser.add_argument('-db', '--database', help="database file in .db format")
+parser.add_argument('-w', '--workflows', nargs="+", default=workflow_runs_monitered, help="workflows to show, one column each")
+parser.add_argument('-b', '--branch', help="only show commits built on this branch")
+parser.add_argument('-r', '--repo', help="repository to list the broken workflows and their suspect commits of")
+parser.add_argument('-n', '--rows', type=int, default=51, help="number of commits to show")
+parser.add_argument('--watch', action="store_true", help="keep running and redraw cells as runs change")
+parser.add_argument('-p', '--period', type=float, default=30, help="seconds between refreshes in watch mode")
 args = parser.parse_args()
 DBFILE = args.database
 
-conn = sqlite3.connect(DBFILE)
-c = conn.cursor()
+# commit, author and message columns in front of the status cells, and the width of a cell
+PREFIX = 6 + 1 + 20 + 3 + 50 + 1
+CELL = 3
+# the matrix starts below the last push and workflow lines
+HEADER_LINES = 2
 
-all_chashes = find_last_main_push(c)
-print(f'last push on main {all_chashes[0][0]} by {all_chashes[0][1]} {(time.mktime(datetime.datetime.now().timetuple()) - all_chashes[0][4]) / 60} minutes ago was a {all_chashes[0][3]}')
 
-c.execute("SELECT * FROM commits ORDER BY time DESC")
-commits = c.fetchall()
-commit_hashes = [(commits[i][1], commits[i][2], commits[i][3]) for i in range(10000)]
-workflow_runs_monitered = ['Push on main', 'PkgCI', 'CI', 'samples', 'CI - Windows x64 MSVC', 'Publish Website', 'CI - Linux arm64 clang']
-results = []
-for commit, _, _ in commit_hashes:
-    for workflow_run in workflow_runs_monitered:
-        c.execute("SELECT archivedcommithash, author, conclusion, status, archivedworkflowname, archivedbranchname FROM workflowruns WHERE archivedcommithash = ? AND archivedworkflowname = ? ORDER BY createtime DESC LIMIT 1", (commit, workflow_run))
-        result = c.fetchall()
-        if result != []:
-            results.append(result)
-conn.close()
-
-results_dict = {"success": "0", "failure": "X", "other": "?", "cancelled": "-"}
-
-print(workflow_runs_monitered)
-
-def find_status(results, hash, run_name):
-    for result in results:
-        if result[0][0] == hash and result[0][4] == run_name:
-            if result[0][2] is not None:
-                return result[0][2]
-    return "other"
+def color(status):
+    if status == "0":
+        return Fore.GREEN + status + Style.RESET_ALL
+    elif status in ("X", "-"):
+        return Fore.RED + status + Style.RESET_ALL
+    return Fore.YELLOW + status + Style.RESET_ALL
+
 
 def add_colors(statuses):
-    new_statuses = ""
-    for status in statuses:
-        if status == "0":
-            new_statuses += (Fore.GREEN + status + Style.RESET_ALL + "  ")
-        elif status =="X":
-            new_statuses += (Fore.RED + status + Style.RESET_ALL + "  ")
-        elif status =="-":
-            new_statuses += (Fore.RED + status + Style.RESET_ALL + "  ")
+    return "".join(color(status) + "  " for status in statuses)
+
+
+def last_push_line(conn):
+    last_push = last_run(conn, 'Push on main')
+    if not last_push:
+        return ""
+    chash, author, _, conclusion, starttime = last_push
+    minutes = (datetime.datetime.utcnow() - starttime).total_seconds() / 60
+    return f'last push on main {chash} by {author} {minutes:.0f} minutes ago was a {conclusion}'
+
+
+def row_line(commit, author, message):
+    message = re.sub("\n", " ", message or "")[:49]
+    return commit[:6] + " " + (author or "")[:20].ljust(20) + "   " + message.ljust(50) + " "
+
+
+def draw(conn, clear=False):
+    """Print the whole waterfall, returns its rows"""
+    rows = waterfall(conn, args.workflows, rows=args.rows, branch=args.branch)
+    if clear:
+        print("\x1b[2J\x1b[H", end="")
+    print(last_push_line(conn))
+    print(args.workflows)
+    for commit, author, message, statuses in rows:
+        print(row_line(commit, author, message) + add_colors(statuses))
+    return rows
+
+
+def print_culprits(conn):
+    """Every monitored workflow that is red on the branch, with the commits that may have broken it"""
+    branch = args.branch or "main"
+    for workflow in args.workflows:
+        interval = blame(conn, args.repo, branch, workflow, limit=10)
+        if not interval:
+            continue
+        first_bad, last_good = interval["first_bad"][0], (interval["last_good"] or ("?", ))[0]
+        print(Fore.RED + f"{workflow} broken on {branch} since {first_bad[:6]}" + Style.RESET_ALL + f" (last good {last_good[:6]})")
+        for commit, author, message, _ in interval["suspects"]:
+            print("    " + row_line(commit, author, message))
+
+
+def redraw_cell(line, column, status):
+    print(f"\x1b[{line};{PREFIX + column * CELL + 1}H" + color(status), end="")
+
+
+def watch(conn):
+    """
+    Redraw only what changed every `period` seconds. Each refresh reads the matrix entries
+    updated since the previous one, a decided run on a commit that is not on screen (a new
+    commit, or one that just finished every workflow) redraws the whole waterfall.
+    """
+    rows = draw(conn, clear=True)
+    cursor = latest_change(conn)
+    # entries at the cursor that are already on screen, the next read starts at the cursor
+    seen = set()
+    if cursor:
+        seen = {(run[0], run[1], run[4]) for run in changed_runs(conn, args.workflows, cursor, args.branch)}
+    while True:
+        time.sleep(args.period)
+        if cursor is None:
+            rows = draw(conn, clear=True)
+            cursor = latest_change(conn)
+            continue
+        changes = changed_runs(conn, args.workflows, cursor, args.branch)
+        changes = [run for run in changes if (run[0], run[1], run[4]) not in seen]
+        cursor = max([cursor] + [endtime for *_, endtime in changes if endtime])
+        seen = {key for key in seen | {(run[0], run[1], run[4]) for run in changes} if key[2] == cursor}
+        lines = {row[0]: i for i, row in enumerate(rows)}
+        # only a decided run can complete a commit that is not on screen, runs still in
+        # progress on hidden commits change nothing visible
+        if any(commit not in lines and conclusion is not None for commit, _, conclusion, *_ in changes):
+            rows = draw(conn, clear=True)
         else:
-            new_statuses += (Fore.YELLOW + status + Style.RESET_ALL + "  ")
-    return new_statuses
-
-printed_commits = 0
-for commit, chash, message in commit_hashes:
-    if len(message) > 50:
-        message = message[:49]
-    statuses = [results_dict[find_status(results, commit, workflow_run_name)] for workflow_run_name in workflow_runs_monitered]
-    if "?" not in statuses:
-        print(commit[:6] + " " + chash.ljust(20) + "   " +  re.sub("\n", " ", message).ljust(50) + " " +  str(add_colors(statuses)))
-        printed_commits += 1
-    if printed_commits > 50: break
-
-    
-        
\ No newline at end of file
+            for commit, workflow, conclusion, _, _ in changes:
+                if commit not in lines:
+                    continue
+                i = lines[commit]
+                column = args.workflows.index(workflow)
+                symbol = STATUS_SYMBOLS.get(conclusion, "?")
+                if rows[i][3][column] != symbol:
+                    rows[i][3][column] = symbol
+                    redraw_cell(HEADER_LINES + i + 1, column, symbol)
+            # refresh the age of the last push and park the cursor below the matrix
+            print(f"\x1b[1;1H\x1b[2K{last_push_line(conn)}", end="")
+            print(f"\x1b[{HEADER_LINES + len(rows) + 1};1H", end="")
+        print(f"\x1b[2Kupdated {datetime.datetime.now():%H:%M:%S}", end="", flush=True)
+
+
+conn = connect_sqlite(DBFILE)
+if args.watch:
+    try:
+        watch(conn)
+    except KeyboardInterrupt:
+        print()
+    finally:
+        conn.close()
+else:
+    start = time.monotonic()
+    rows = draw(conn)
+    if args.repo:
+        print_culprits(conn)
+    conn.close()
+    print(f"{len(rows)} commits in {time.monotonic() - start:.2f}s")